@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line batch runs of the CMIP ensemble.
+
+Scenarios come either from the columns of an emission table (xlsx, CSV or
+Parquet; a 'Year' column gives the start year) or from a grid over the
+Emission parameters, and results are written to CSV, Parquet or npz:
+
+    python BatchRunner.py data/RCPemissions.xlsx -o rcp.csv
+    python BatchRunner.py --grid peak_emission=0.5:2:100 --grid peak_year=2030:2079:50 \\
+        --grid halve_year=2080,2090 --models MIROC6 CanESM2 -o sweep.parquet
+
+Scenarios are run block_size at a time through ParallelRunner.Run_parallel,
+on one process pool shared by all blocks, and every block is written out
+before the next one is built (grid paths are generated per block), so
+memory depends on the block size and not on the number of scenarios. CSV
+and Parquet hold one row per scenario and model with one column per year;
+with several variables each goes to its own file (name_Tatm.csv, ...).
+npz files hold one (scenario, model, year) array per variable, spooled to
+disk during the run. Progress and the throughput in scenario-model-years
+per second are reported on stderr.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+from EmulatorCore import CMIP, SWEEP_VARIABLES
+from ParallelRunner import Run_parallel
+from Results import simulation_years
+from UserEmission import DEFAULTS, EMISSION_PARAMETERS, START_YEAR, emission_matrix
+
+FORMATS = ('.csv', '.parquet', '.npz')
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError('Parquet files need pyarrow (pip install pyarrow)') from None
+
+
+def read_scenarios(path, sheet = 'Emission', columns = None, year_column = 'Year'):
+    """Emission paths stored as the columns of a table.
+
+    Returns (names, start_year, emissions) with emissions of shape
+    (n_scenarios, n_periods). Non-numeric columns are ignored unless named
+    in columns.
+    """
+    import pandas as pd
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in ('.xlsx', '.xls'):
+        table = pd.read_excel(path, sheet_name=sheet)
+    elif suffix == '.csv':
+        table = pd.read_csv(path)
+    elif suffix == '.parquet':
+        _require_pyarrow()
+        table = pd.read_parquet(path, columns=None if columns is None else
+                                list(columns) + [year_column])
+    else:
+        raise ValueError(f'cannot read scenarios from {suffix} files')
+    start_year = START_YEAR
+    if year_column in table.columns:
+        start_year = int(table[year_column].iloc[0])
+        table = table.drop(columns=year_column)
+    if columns is None:
+        table = table.select_dtypes('number')
+    else:
+        table = table[list(columns)]
+    if table.shape[1] == 0:
+        raise ValueError(f'no emission columns in {path}')
+    emissions = table.to_numpy(dtype=float).T
+    if not np.all(np.isfinite(emissions)):
+        raise ValueError(f'{path} has missing or non-numeric emissions')
+    return [str(name) for name in table.columns], start_year, np.ascontiguousarray(emissions)
+
+
+def parse_grid(specs):
+    """Grid axes from 'name=start:stop:num' or 'name=v1,v2,...' strings."""
+    axes = {}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        name = name.strip().replace('-', '_')
+        if not sep or name not in EMISSION_PARAMETERS:
+            raise ValueError(f"grid axes look like peak_year=2030:2080:11 with one of "
+                             f"{', '.join(EMISSION_PARAMETERS)}; got '{spec}'")
+        if ':' in values:
+            start, stop, num = values.split(':')
+            axis = np.linspace(float(start), float(stop), int(num))
+        else:
+            axis = np.array([float(v) for v in values.split(',')])
+        if name.endswith('_year'):
+            axis = np.round(axis)
+        axes[name] = axis
+    for name in EMISSION_PARAMETERS:
+        axes.setdefault(name, np.array([float(DEFAULTS[name])]))
+    # every combination must be a valid path
+    if not (axes['peak_year'].min() > START_YEAR
+            and axes['peak_year'].max() < axes['halve_year'].min()
+            and axes['halve_year'].max() < axes['end_year'].min()):
+        raise ValueError(f'the grid must keep {START_YEAR} < peak_year < halve_year < end_year '
+                         'for every combination')
+    return axes
+
+
+def iter_grid(axes, block_size):
+    """Yield (start, stop, labels, emissions) for blocks of the grid's scenarios.
+
+    Scenarios enumerate the Cartesian product of the axes in C order; labels
+    maps every Emission parameter to its (stop-start,) values.
+    """
+    shape = tuple(len(axes[name]) for name in EMISSION_PARAMETERS)
+    n_scenarios = int(np.prod(shape))
+    num_periods = int(axes['end_year'].max()) - START_YEAR + 1
+    for start in range(0, n_scenarios, block_size):
+        stop = min(start + block_size, n_scenarios)
+        index = np.unravel_index(np.arange(start, stop), shape)
+        labels = {name: axes[name][i] for name, i in zip(EMISSION_PARAMETERS, index)}
+        _, emissions = emission_matrix(*(labels[name] for name in EMISSION_PARAMETERS))
+        if emissions.shape[1] < num_periods:
+            # paths ending early stay at their end emission
+            emissions = np.pad(emissions, ((0, 0), (0, num_periods - emissions.shape[1])),
+                               mode='edge')
+        yield start, stop, labels, emissions
+
+
+def iter_table(names, emissions, block_size):
+    for start in range(0, emissions.shape[0], block_size):
+        stop = min(start + block_size, emissions.shape[0])
+        labels = {'Name': np.array(names[start:stop], dtype=object)}
+        yield start, stop, labels, emissions[start:stop]
+
+
+class _TableWriter:
+    """Rows of (scenario, labels, Model, one column per year), appended per block."""
+    def __init__(self, path, variable, years, Model_names):
+        self.path = Path(path)
+        self.variable = variable
+        self.years = years
+        self.Model_names = Model_names
+        self._parquet = None
+        self._header = True
+
+    def write(self, start, labels, values):
+        import pandas as pd
+        n, n_models, n_years = values.shape
+        Model_names = self.Model_names if n_models == len(self.Model_names) else ['']
+        rows = {'scenario': np.repeat(np.arange(start, start + n), n_models)}
+        for name, column in labels.items():
+            rows[name] = np.repeat(column, n_models)
+        rows['Model'] = np.tile(np.array(Model_names, dtype=object), n)
+        frame = pd.DataFrame(rows)
+        block = pd.DataFrame(values.reshape(n*n_models, n_years),
+                             columns=[str(y) for y in self.years[:n_years]])
+        frame = pd.concat([frame, block], axis=1)
+        if self.path.suffix.lower() == '.csv':
+            frame.to_csv(self.path, mode='w' if self._header else 'a', header=self._header,
+                         index=False)
+            self._header = False
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+class _NpzWriter:
+    """(scenario, model, year) arrays spooled to .npy files, zipped on close."""
+    def __init__(self, path, variables, shapes, years, Model_names):
+        self.path = Path(path)
+        self.tmp = Path(tempfile.mkdtemp(dir=self.path.parent, prefix='.' + self.path.stem))
+        self.arrays = {name: np.lib.format.open_memmap(self.tmp/f'{name}.npy', mode='w+',
+                                                       dtype=float, shape=shapes[name])
+                       for name in variables}
+        self.labels = {}
+        self.extra = {'Year': years, 'Model': np.array(Model_names)}
+
+    def write(self, start, labels, results):
+        for name, out in self.arrays.items():
+            values = results[name]
+            out[start:start + values.shape[0]] = values
+        for name, column in labels.items():
+            self.labels.setdefault(name, []).append(column)
+
+    def close(self):
+        try:
+            extra = dict(self.extra)
+            for name, columns in self.labels.items():
+                column = np.concatenate(columns)
+                extra[name] = column.astype(str) if column.dtype == object else column
+            with zipfile.ZipFile(self.path, 'w', allowZip64=True) as zf:
+                for name, out in self.arrays.items():
+                    out.flush()
+                    zf.write(self.tmp/f'{name}.npy', arcname=f'{name}.npy')
+                for name, values in extra.items():
+                    buffer = BytesIO()
+                    np.save(buffer, values)
+                    zf.writestr(f'{name}.npy', buffer.getvalue())
+        finally:
+            self.arrays.clear()
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def _output_path(path, variable, variables):
+    if len(variables) == 1:
+        return path
+    return path.with_name(f'{path.stem}_{variable}{path.suffix}')
+
+
+def run_batch(blocks, n_scenarios, num_periods, output, Model_names = None, variables = ('Tatm',),
+              dt = 1, Forcing_factor = 1.1, start_year = START_YEAR, workers = None,
+              chunk_size = 256, progress = None):
+    """Run the (start, stop, labels, emissions) blocks and write them to output.
+
+    progress, if given, is called after every block with (scenarios done,
+    n_scenarios, seconds elapsed). Returns the throughput summary.
+    """
+    output = Path(output)
+    if output.suffix.lower() not in FORMATS:
+        raise ValueError(f"output must end with one of {', '.join(FORMATS)}")
+    if output.suffix.lower() == '.parquet':
+        _require_pyarrow()
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    Model_names = list(Model_names)
+    for name in variables:
+        if name not in SWEEP_VARIABLES:
+            raise KeyError(f"unknown sweep variable '{name}'")
+    years = simulation_years(num_periods, dt, start_year)
+    if output.suffix.lower() == '.npz':
+        shapes = {name: (n_scenarios, 1 if name.startswith('M_') else len(Model_names),
+                         num_periods if name == 'Forcing' else num_periods + 1)
+                  for name in variables}
+        npz = _NpzWriter(output, variables, shapes, years, Model_names)
+        writers = None
+    else:
+        npz = None
+        writers = {name: _TableWriter(_output_path(output, name, variables), name, years,
+                                      Model_names)
+                   for name in variables}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # one pool for all blocks instead of one per Run_parallel call
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    start_time = time.perf_counter()
+    simulated = 0.
+    done = 0
+    try:
+        for start, stop, labels, emissions in blocks:
+            tic = time.perf_counter()
+            results = Run_parallel(emissions, Model_names, dt, Forcing_factor, variables,
+                                   workers=workers, chunk_size=chunk_size, executor=executor)
+            simulated += time.perf_counter() - tic
+            if npz is not None:
+                npz.write(start, labels, results)
+            else:
+                for name, writer in writers.items():
+                    writer.write(start, labels, results[name])
+            done = stop
+            if progress is not None:
+                progress(done, n_scenarios, time.perf_counter() - start_time)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for writer in ([npz] if npz is not None else list(writers.values())):
+            writer.close()
+    elapsed = time.perf_counter() - start_time
+    work = done*len(Model_names)*(num_periods + 1)
+    return {'scenarios': done,
+            'models': len(Model_names),
+            'years': num_periods + 1,
+            'seconds': elapsed,
+            'simulation_seconds': simulated,
+            'throughput': work/elapsed if elapsed > 0 else float('inf')}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description='Run the CMIP ensemble over emission scenarios and write the results.')
+    parser.add_argument('input', nargs='?',
+                        help='xlsx, CSV or Parquet table with one emission path per column')
+    parser.add_argument('--sheet', default='Emission', help='xlsx sheet (default Emission)')
+    parser.add_argument('--columns', nargs='+',
+                        help='columns of input to run (default: all numeric)')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=SPEC',
+                        help='Emission parameter axis, start:stop:num or v1,v2,...; '
+                             'repeat for several axes, the others keep the dashboard defaults')
+    parser.add_argument('-o', '--output', required=True, help='.csv, .parquet or .npz file')
+    parser.add_argument('--models', nargs='+', help='CMIP model names (default: all)')
+    parser.add_argument('--variables', nargs='+', default=['Tatm'], choices=SWEEP_VARIABLES)
+    parser.add_argument('--dt', type=float, default=1)
+    parser.add_argument('--forcing-factor', type=float, default=1.1)
+    parser.add_argument('--block-size', type=int, default=4096,
+                        help='scenarios held in memory at once (default 4096)')
+    parser.add_argument('--chunk-size', type=int, default=256, help='scenarios per worker task')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all CPUs)')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    if (args.input is None) == (not args.grid):
+        parser.error('give either an input table or --grid axes')
+    if args.block_size < 1:
+        parser.error('--block-size must be positive')
+    try:
+        if args.input is not None:
+            names, start_year, emissions = read_scenarios(args.input, args.sheet, args.columns)
+            n_scenarios, num_periods = emissions.shape
+            blocks = iter_table(names, emissions, args.block_size)
+        else:
+            axes = parse_grid(args.grid)
+            start_year = START_YEAR
+            n_scenarios = int(np.prod([len(v) for v in axes.values()]))
+            num_periods = int(axes['end_year'].max()) - START_YEAR + 1
+            blocks = iter_grid(axes, args.block_size)
+        if Path(args.output).suffix.lower() == '.parquet':
+            _require_pyarrow()
+        if args.models is not None:
+            unknown = [name for name in args.models if name not in CMIP.index]
+            if unknown:
+                raise ValueError(f'unknown models {unknown}')
+    except (OSError, ValueError, KeyError) as exc:
+        parser.error(str(exc))
+    n_models = len(args.models) if args.models is not None else len(CMIP.index)
+
+    def report(done, total, elapsed):
+        rate = done*n_models*(num_periods + 1)/elapsed if elapsed > 0 else float('inf')
+        print(f'{done}/{total} scenarios  {elapsed:.1f} s  {rate:,.0f} scenario-model-years/s',
+              file=sys.stderr)
+
+    summary = run_batch(blocks, n_scenarios, num_periods, args.output, args.models, args.variables,
+                        args.dt, args.forcing_factor, start_year, args.workers, args.chunk_size,
+                        progress=None if args.quiet else report)
+    if not args.quiet:
+        print(f"wrote {summary['scenarios']} scenarios x {summary['models']} models x "
+              f"{summary['years']} years to {args.output} in {summary['seconds']:.2f} s "
+              f"({summary['simulation_seconds']:.2f} s simulating), "
+              f"{summary['throughput']:,.0f} scenario-model-years/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
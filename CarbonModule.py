@@ -6,11 +6,10 @@ Created on Mon Mar 25 17:25:56 2024
 """
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
 import numpy as np
-from numpy.linalg import matrix_power
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import pandas as pd
+
+from LinearSystem import matrix_powers, impulse_response, free_response, causal_convolve
 
 
 
@@ -31,26 +30,28 @@ class CarbonModule(ABC):
     
     
 class CarbonCycle(CarbonModule):
-    def __init__(self, para_Carbon, initial_Carbon_mass, dt = 1 ):
+    """Three-reservoir carbon cycle.
+    
+    By default the histories are dicts of growing lists. With horizon = n
+    the states are written into one preallocated float64 block of shape
+    (3, n+1, *shape) instead (rows M_at, M_up, M_lo), getFinal returns
+    views into it and clear only rewinds the step counter. shape defaults
+    to the broadcast shape of the initial masses.
+    """
+    def __init__(self, para_Carbon, initial_Carbon_mass, dt = 1, horizon = None, shape = None):
         self.para_Carbon = para_Carbon
         self.initial_Carbon_mass = initial_Carbon_mass
         self.dt = dt
-        self.M_at = {'M_at':[self.initial_Carbon_mass.get('M0_at')]}
-        self.M_up = {'M_up':[self.initial_Carbon_mass.get('M0_up')]}
-        self.M_lo = {'M_lo':[self.initial_Carbon_mass.get('M0_lo')]}
+        self.horizon = horizon
+        if horizon is not None:
+            if shape is None:
+                shape = np.broadcast_shapes(*(np.shape(self.initial_Carbon_mass.get(k))
+                                              for k in ('M0_at', 'M0_up', 'M0_lo')))
+            self.state = np.empty((3, horizon + 1) + tuple(shape))
+        self.clear()
        
     def carbon_diffusion(self):
-        r1 = self.para_Carbon.get('Meq_at')/self.para_Carbon.get('Meq_up')
-        r2 = self.para_Carbon.get('Meq_up')/self.para_Carbon.get('Meq_lo')
-        b11 = -self.para_Carbon.get('b12')
-        b13 = 0         
-        b21 = self.para_Carbon.get('b12')*r1 
-        b22 = -b21-self.para_Carbon.get('b23')
-        b31 = 0
-        b32 = self.para_Carbon.get('b23')*r2  
-        b33 = -b32  
-        b = np.array ([[b11,b21,b31],[self.para_Carbon.get('b12'),b22,b32],[b13,self.para_Carbon.get('b23'),b33]]) # time independent diffusion matrix
-        bb = np.eye(3) + self.dt*b ## time-step dependent diffusion matrix
+        bb = diffusion_matrix(*self._key())
         
         b11 = bb[0,0]
         b13 = bb[2,0]         
@@ -62,6 +63,11 @@ class CarbonCycle(CarbonModule):
         b12 = bb[1,0]
         b23 = bb[2,1]
         return(b11,b13,b21,b22,b31,b32,b33,b12,b23,bb)
+    
+    def _key(self):
+        return (float(self.para_Carbon.get('b12')), float(self.para_Carbon.get('b23')),
+                float(self.para_Carbon.get('Meq_at')), float(self.para_Carbon.get('Meq_up')),
+                float(self.para_Carbon.get('Meq_lo')), float(self.dt))
   
     def updateCarbon(self, carbon_emission, M_at, M_up, M_lo):
     
@@ -70,9 +76,16 @@ class CarbonCycle(CarbonModule):
         M_up = M_at*b12 + M_up*b22 + M_lo*b32
         M_lo = M_lo*b33 + M_up*b23
         
-        self.M_at['M_at'].append(M_at)
-        self.M_up['M_up'].append(M_up)
-        self.M_lo['M_lo'].append(M_lo)
+        if self.horizon is None:
+            self.M_at['M_at'].append(M_at)
+            self.M_up['M_up'].append(M_up)
+            self.M_lo['M_lo'].append(M_lo)
+        else:
+            self.n += 1
+            state = self.state[:, self.n]
+            state[0] = M_at
+            state[1] = M_up
+            state[2] = M_lo
         
     def updateForcing(self):
         pass
@@ -80,17 +93,104 @@ class CarbonCycle(CarbonModule):
         
         
     def getFinal(self):
+        if self.horizon is not None:
+            n = self.n + 1
+            return({'M_at': self.state[0, :n]}, {'M_up': self.state[1, :n]}, {'M_lo': self.state[2, :n]})
         
         return(self.M_at, self.M_up, self.M_lo)
     
     def getLast(self):
+        if self.horizon is not None:
+            state = self.state[:, self.n]
+            return (state[0], state[1], state[2])
         return (self.M_at['M_at'][-1], self.M_up['M_up'][-1], self.M_lo['M_lo'][-1])
     
 
     
     def clear(self):
+        if self.horizon is not None:
+            self.n = 0
+            self.state[0, 0] = self.initial_Carbon_mass.get('M0_at')
+            self.state[1, 0] = self.initial_Carbon_mass.get('M0_up')
+            self.state[2, 0] = self.initial_Carbon_mass.get('M0_lo')
+            return
         
         self.M_at = {'M_at':[self.initial_Carbon_mass.get('M0_at')]}
         self.M_up = {'M_up':[self.initial_Carbon_mass.get('M0_up')]}
         self.M_lo = {'M_lo':[self.initial_Carbon_mass.get('M0_lo')]}
-       
\ No newline at end of file
+    
+    def roll(self):
+        # drop the history but keep the latest state, so that a run stepped
+        # one period at a time (see EmulatorCore.iter_steps) needs constant memory
+        if self.horizon is not None:
+            self.state[:, 0] = self.state[:, self.n]
+            self.n = 0
+            return
+        self.M_at = {'M_at': self.M_at['M_at'][-1:]}
+        self.M_up = {'M_up': self.M_up['M_up'][-1:]}
+        self.M_lo = {'M_lo': self.M_lo['M_lo'][-1:]}
+    
+    def propagator(self, num_periods, sequential = True):
+        """Return (powers, kernel) of the reservoir update for num_periods steps.
+        
+        powers[k] = A^k and kernel[k] = A^k g where M_{t+1} = A M_t + g e_t.
+        With sequential = True, A and g reproduce updateCarbon, which reuses
+        the freshly updated M_at in M_up and M_up in M_lo; otherwise
+        A = bb and g = (1, 0, 0). Both are cached per (para_Carbon, dt).
+        """
+        return carbon_propagator(self._key(), bool(sequential), int(num_periods))
+    
+    def runHorizon(self, carbon_emission, sequential = True):
+        """Compute M_at, M_up, M_lo for a whole emission path at once.
+        
+        carbon_emission holds the per-step emission (as passed to
+        updateCarbon) with time on the last axis, shape (..., n). Returns
+        three arrays of shape (..., n+1) starting from the initial masses.
+        The stored histories are not modified.
+        """
+        carbon_emission = np.asarray(carbon_emission, dtype=float)
+        num_periods = carbon_emission.shape[-1]
+        powers, kernel = self.propagator(num_periods, sequential)
+        M0 = np.stack(np.broadcast_arrays(self.initial_Carbon_mass.get('M0_at'),
+                                          self.initial_Carbon_mass.get('M0_up'),
+                                          self.initial_Carbon_mass.get('M0_lo')), axis=-1)
+        M = free_response(powers, M0) + causal_convolve(kernel, carbon_emission)
+        return(M[..., 0], M[..., 1], M[..., 2])
+
+
+@lru_cache(maxsize=64)
+def diffusion_matrix(b12, b23, Meq_at, Meq_up, Meq_lo, dt):
+    """Time-step dependent diffusion matrix bb = I + dt*b (read-only)."""
+    r1 = Meq_at/Meq_up
+    r2 = Meq_up/Meq_lo
+    b11 = -b12
+    b13 = 0         
+    b21 = b12*r1 
+    b22 = -b21-b23
+    b31 = 0
+    b32 = b23*r2  
+    b33 = -b32  
+    b = np.array ([[b11,b21,b31],[b12,b22,b32],[b13,b23,b33]]) # time independent diffusion matrix
+    bb = np.eye(3) + dt*b ## time-step dependent diffusion matrix
+    bb.setflags(write=False)
+    return bb
+
+
+@lru_cache(maxsize=64)
+def carbon_propagator(key, sequential, num_periods):
+    bb = diffusion_matrix(*key)
+    if sequential:
+        # updateCarbon writes M_at first and uses it for M_up, then M_up for M_lo
+        A = np.zeros((3, 3))
+        A[0] = [bb[0,0], bb[0,1], 0]
+        A[1] = bb[1,0]*A[0] + [0, bb[1,1], bb[1,2]]
+        A[2] = bb[2,1]*A[1] + [0, 0, bb[2,2]]
+        g = np.array([1, bb[1,0], bb[2,1]*bb[1,0]])
+    else:
+        A = bb
+        g = np.array([1., 0., 0.])
+    powers = matrix_powers(A, num_periods)
+    kernel = impulse_response(powers, g)
+    powers.setflags(write=False)
+    kernel.setflags(write=False)
+    return powers, kernel
@@ -6,21 +6,22 @@ Created on Tue Apr 23 09:58:15 2024
 """
 
 
-from abc import ABC, abstractmethod
-import numpy as np
-from numpy.linalg import matrix_power
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import pandas as pd
-from plotly.subplots import make_subplots
+import os
+import threading
+from collections import namedtuple
+from types import MappingProxyType
 
-from pathlib import Path
+import numpy as np
 
 
 from CarbonModule import CarbonCycle
 from TempModule import DICETemp
-
-import os
+from PlotModule import EmulatorPlot
+from SimulationCache import SimulationCache, CheckpointStore, emission_digest
+import ParameterStore
+import Instrumentation
+import Sensitivity
+from Results import ResultTable, simulation_years
 
 # # Set the path to the folder you want as your working directory
 # desired_path = r"C:\Users\F_ZHANG\Documents\GitHub\ClimateEmulatorAPP\EmulatorCode\PythonCode"
@@ -28,27 +29,112 @@ import os
 # os.chdir(desired_path)
 # print(os.getcwd())  # Confirm you've moved to the right location
 
-DATA_FILENAME_CMIP = Path(__file__).parent/'data/CMIPparas.xlsx'
-CMIP = pd.read_excel(DATA_FILENAME_CMIP, sheet_name = 'CMIP')
-CMIP5 = pd.read_excel(DATA_FILENAME_CMIP, sheet_name = 'CMIP5')
-CMIP6 = pd.read_excel(DATA_FILENAME_CMIP, sheet_name = 'CMIP6')
-list_models_CMIP5 = CMIP5['Model'].tolist()
-list_models_CMIP6 = CMIP6['Model'].tolist()
-list_models_CMIP5.sort()
-list_models_CMIP5.remove('MMM_CMIP5')
-list_models_CMIP5.insert(0,'MMM_CMIP5')
-list_models_CMIP6.sort() #.remove('MMM_CMIP6').insert(0,'MMM_CMIP6')
-print(list_models_CMIP5)
-print(list_models_CMIP6)
-CMIP.set_index('Model', inplace=True)
-
-
-DATA_FILENAME_CARBON = Path(__file__).parent/'data/CMIPparas.xlsx'
-Carbon = pd.read_excel(DATA_FILENAME_CARBON, sheet_name = 'carbon')
-Carbon.set_index('Model', inplace=True)
-
-
-class Emulator:
+# parameter tables are compiled to data/CMIPparas.cache.npz and only read
+# on first access, see ParameterStore
+DATA_FILENAME_CMIP = ParameterStore.DATA_FILENAME_CMIP
+CMIP = ParameterStore.table('CMIP')
+CMIP5 = ParameterStore.table('CMIP5')
+CMIP6 = ParameterStore.table('CMIP6')
+
+DATA_FILENAME_CARBON = ParameterStore.DATA_FILENAME_CMIP
+Carbon = ParameterStore.table('carbon')
+
+
+def __getattr__(name):
+    # model lists sorted with the multi-model mean first, built on demand
+    if name == 'list_models_CMIP5':
+        list_models_CMIP5 = sorted(CMIP5.index.tolist())
+        list_models_CMIP5.remove('MMM_CMIP5')
+        list_models_CMIP5.insert(0,'MMM_CMIP5')
+        return list_models_CMIP5
+    if name == 'list_models_CMIP6':
+        return sorted(CMIP6.index.tolist())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+ModelRecord = namedtuple('ModelRecord', ['para_Temp', 'para_Forcing', 'initial_Temp',
+                                         'para_Carbon', 'initial_Carbon_mass'])
+
+_model_records = {}
+_model_records_lock = threading.Lock()
+
+
+def compile_model(Model, CarbonModel, Forcing_factor = 1.1):
+    """Build the DICETemp/CarbonCycle parameter dicts of one model as read-only mappings."""
+    para_Temp = {'c1': Model['c1'], 'c3': Model['c3'], 'c4': Model['c4'],
+                 'ECS': Model['ECS'], 'lambda': Model['lambda']}
+    para_Forcing = {'F2xco2': Model['F2xco2'], 'Meq_at': CarbonModel['Meq_at'],
+                    'Forc_fac': Forcing_factor}
+    initial_Temp = {'tatm0': Model['Tatm0'], 'tocean0': Model['Tocean0']}
+    para_Carbon = {'b12': CarbonModel['b12'], 'b23': CarbonModel['b23'],
+                   'Meq_at': CarbonModel['Meq_at'], 'Meq_up': CarbonModel['Meq_up'],
+                   'Meq_lo': CarbonModel['Meq_lo']}
+    initial_Carbon_mass = {'M0_at': CarbonModel['M0_at'], 'M0_up': CarbonModel['M0_up'],
+                           'M0_lo': CarbonModel['M0_lo']}
+    return ModelRecord(*(MappingProxyType(d) for d in
+                         (para_Temp, para_Forcing, initial_Temp, para_Carbon, initial_Carbon_mass)))
+
+
+def model_record(Model, CarbonModel, Forcing_factor = 1.1):
+    """compile_model, memoized on the parameter table rows.
+
+    Model and CarbonModel are usually rows of the CMIP and Carbon tables;
+    anything else (e.g. an edited pandas Series) is compiled every time.
+    """
+    try:
+        key = (Model.key, CarbonModel.key, float(Forcing_factor))
+    except AttributeError:
+        return compile_model(Model, CarbonModel, Forcing_factor)
+    record = _model_records.get(key)
+    if record is None:
+        record = compile_model(Model, CarbonModel, Forcing_factor)
+        with _model_records_lock:
+            _model_records[key] = record
+    return record
+
+
+StepRecord = namedtuple('StepRecord', ['Year', 'M_at', 'M_up', 'M_lo', 'Forcing', 'Tatm', 'Tocean'])
+
+
+def iter_steps(TempClass, CarbonClass, emission, dt = 1, start_year = 2020, run_sim_order = True):
+    """Step a DICETemp/CarbonCycle pair through an emission iterable.
+
+    Yields one StepRecord per year, starting with the initial state, so n
+    emissions give n+1 records; Forcing is the forcing of that year's M_at
+    (the one driving the next step). The states are advanced as in
+    Emulator.Run_sim, and the pair's history is dropped after every step
+    (roll), so memory stays constant however long the run. Each emission
+    item is the annual rate (multiplied by dt) and is only requested after
+    the previous record has been consumed. Record values are copies.
+    run_sim_order = False uses the two-box ocean update instead, see
+    DICETemp.runHorizon.
+    """
+    emission = iter(emission)
+    i_step = 0
+    while True:
+        M_at, M_up, M_lo = CarbonClass.getLast()
+        TempClass.updateForcing(M_at)
+        tatm, tocean, forcing = TempClass.getLast()
+        yield StepRecord(start_year + i_step*dt, M_at.copy(), M_up.copy(), M_lo.copy(),
+                         forcing.copy(), tatm.copy(), tocean.copy())
+        try:
+            carbon_emission = next(emission)*dt
+        except StopIteration:
+            return
+        TempClass.updateSurTemp(tatm, tocean, forcing)
+        if run_sim_order:
+            TempClass.updateOceanTemp(tatm, tocean)
+        else:
+            TempClass.updateOceanTemp(tocean, tatm)
+        CarbonClass.updateCarbon(carbon_emission, M_at, M_up, M_lo)
+        TempClass.roll()
+        CarbonClass.roll()
+        i_step += 1
+
+
+class Emulator(EmulatorPlot):
+    # plotting methods (Plot_Temp, update_Plot, CMIP5_prediction,
+    # CMIP6_prediction) are in PlotModule.EmulatorPlot
     def __init__(self, Carbon_emission = [], Model_name = 'MMM_CMIP6', dt = 1):
         self.start_year = 2020
         self.emission = Carbon_emission
@@ -60,8 +146,9 @@ class Emulator:
         self.Model_name = Model_name
         self.tatm_max = 0
         self.tatm_min = 0
-        self.fig = make_subplots(rows=1, cols=2,
-                            horizontal_spacing=0.15, vertical_spacing=0.1)
+        self.fig = None # created on first plot
+        self.TempClass = None # built by TempParameter, then reused
+        self.CarbonClass = None
         self.custom_colors = [
             '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
             '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
@@ -72,33 +159,25 @@ class Emulator:
             ]
         
     def TempParameter(self):
-        c1 = self.Model['c1']
-        c3 = self.Model['c3']
-        c4 = self.Model['c4']
-        ECS = self.Model['ECS']
-        Lambda = self.Model['lambda']
-        F2xco2 = self.Model['F2xco2']
-        tatm0 = self.Model['Tatm0']
-        tocean0 = self.Model['Tocean0']
-        b12 = self.CarbonModel['b12']
-        b23 = self.CarbonModel['b23']
-        Meq_at = self.CarbonModel['Meq_at']
-        Meq_up = self.CarbonModel['Meq_up']
-        Meq_lo = self.CarbonModel['Meq_lo']
-        M0_at = self.CarbonModel['M0_at']
-        M0_up = self.CarbonModel['M0_up']
-        M0_lo = self.CarbonModel['M0_lo']
+        # the parameter dicts are compiled once per model (see model_record);
+        # existing DICETemp/CarbonCycle objects with the right horizon are
+        # kept and only get the new parameters, clear() then resets them
+        record = model_record(self.Model, self.CarbonModel, self.Forcing_factor)
         dt = self.dt
-        para_Temp = {'c1':c1, 'c3': c3, 'c4':c4, 'ECS':ECS,  'lambda':Lambda}
-        para_Forcing = {'F2xco2':F2xco2, 'Meq_at': Meq_at, 'Forc_fac':self.Forcing_factor}
-        initial_Temp = {'tatm0': tatm0, 'tocean0': tocean0}
-        para_Carbon = {'b12':b12, 'b23':b23, 'Meq_at':Meq_at,
-                       'Meq_up':Meq_up, 'Meq_lo': Meq_lo}
-        initial_Carbon_mass = {'M0_at':M0_at, 'M0_up':M0_up, 'M0_lo': M0_lo}
-        TempClass = DICETemp(para_Temp, initial_Temp, para_Forcing, dt = dt)
-        self.TempClass = TempClass
-        CarbonClass = CarbonCycle(para_Carbon, initial_Carbon_mass, dt = dt)
-        self.CarbonClass = CarbonClass
+        num_periods = int(round((self.end_year-self.start_year)/self.dt))
+        TempClass = self.TempClass
+        CarbonClass = self.CarbonClass
+        if TempClass is None or TempClass.horizon != num_periods or TempClass.dt != dt:
+            self.TempClass = DICETemp(record.para_Temp, record.initial_Temp, record.para_Forcing,
+                                      dt = dt, horizon = num_periods)
+            self.CarbonClass = CarbonCycle(record.para_Carbon, record.initial_Carbon_mass,
+                                           dt = dt, horizon = num_periods)
+        else:
+            TempClass.para_Temp = record.para_Temp
+            TempClass.initial_Temp = record.initial_Temp
+            TempClass.para_Forcing = record.para_Forcing
+            CarbonClass.para_Carbon = record.para_Carbon
+            CarbonClass.initial_Carbon_mass = record.initial_Carbon_mass
         
     
     def clear(self):
@@ -107,7 +186,7 @@ class Emulator:
         self.TempClass.clear()
     def Run_sim(self):
         self.clear()
-        num_periods = int(((self.end_year-self.start_year)/self.dt))
+        num_periods = int(round((self.end_year-self.start_year)/self.dt))
         
         for i_step in range(num_periods):
             carbon_emission= self.emission[i_step]*self.dt
@@ -122,52 +201,30 @@ class Emulator:
             self.tatm_max = np.max(tatm['Tatm'])
         if self.tatm_min > np.min(tatm['Tatm']):
             self.tatm_min = np.min(tatm['Tatm'])
-        return(tatm['Tatm'], tocean['Tocean']) 
+        # copies, the state block is reused by the next run
+        return(tatm['Tatm'].copy(), tocean['Tocean'].copy()) 
+    
+    def iter_sim(self, emission = None):
+        """Yield a StepRecord per year as the run advances.
+
+        emission may be any iterable, including a generator that is only
+        consumed as far as the caller iterates; it defaults to the
+        Emulator's emission. Only the current state is kept in memory.
+        """
+        record = model_record(self.Model, self.CarbonModel, self.Forcing_factor)
+        TempClass = DICETemp(record.para_Temp, record.initial_Temp, record.para_Forcing,
+                             dt = self.dt, horizon = 1)
+        CarbonClass = CarbonCycle(record.para_Carbon, record.initial_Carbon_mass,
+                                  dt = self.dt, horizon = 1)
+        if emission is None:
+            emission = self.emission
+        return iter_steps(TempClass, CarbonClass, emission, self.dt, self.start_year)
+    
+    def Jacobian(self, parameters = Sensitivity.PARAMETERS):
+        """dTatm/demission and dTatm/dparameter of the last Run_sim, see Sensitivity.jacobian."""
+        return Sensitivity.jacobian(self.TempClass, self.CarbonClass, parameters)
     
     
-    def Plot_Temp(self):
-        tatm_value, _, = self.Run_sim()
-        #n = int((end_year-self.start_year)/self.dt+1) ## number of periods
-        x_year = np.arange(self.start_year, self.end_year, self.dt)
-        # Create the first trace with the first y-axis
-        #fig = go.Figure()
-        self.fig.update_annotations(font_size=30)
-        self.fig.add_trace(go.Scatter(x=x_year, y = self.emission, mode='lines', name='Emissions' ,
-                                      
-                                      showlegend= False),
-                           row = 1, col = 1)
-
-        # Create the second trace with the second y-axis
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_value, mode='lines', name=f"{self.Model_name}"),
-                           row = 1, col = 2)
-        
-        self.fig.update_yaxes(title_text="Emission (Gigaton Carbon/year)",
-                         range=[np.min(self.emission)-1,np.max(self.emission)+1],
-                         title_standoff=25, title_font=dict(size=25), row = 1, col =1)
-        self.fig.update_yaxes(title_text="Global surface temperature anomaly (°C)",
-                         range = [0,self.tatm_max+1],
-                         title_standoff=25, title_font=dict(size=25), row = 1, col =2)
-        self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =1)
-        self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =2)
-        
-        self.fig.update_layout(
-            title_text = '',
-            title=dict(
-                font=dict(
-                    size=25  # Adjust the font size here
-                    )
-                ),
-            annotations=[
-        dict(text="Emission data", x=0.2, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25)),
-        dict(text="Temperature anomaly prediction", x=0.9, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25))
-    ]
-            )
-
-        self.fig.update_layout(colorway=self.custom_colors)
-        # # Show the plot
-        # self.fig.write_html('first_figure.html', auto_open=True)
-        return self.fig
-        
     def update_model(self, Model_name):
         self.Model_name = Model_name
         self.Model = CMIP.loc[Model_name]
@@ -175,393 +232,326 @@ class Emulator:
         self.update_Plot()
        
         
-    def update_Plot(self):
-        tatm_value, _, = self.Run_sim()
-        
-        #n = int((end_year-self.start_year)/self.dt+1) ## number of periods
-        x_year = np.arange(self.start_year, self.end_year, self.dt)
-        
-        # Create the second trace with the second y-axis
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_value, mode='lines', name= f"{self.Model_name}"),
-                           row = 1, col = 2)
-        # Add layout settings
-        self.fig.update_yaxes(title_text="Global surface temperature anomaly (°C)",
-                         range = [0,self.tatm_max + 0.5],
-                         title_standoff=25, title_font=dict(size=25), row = 1, col =2)
-        self.fig.update_layout(colorway=self.custom_colors)
-        # # Show the plot
-        # self.fig.write_html('first_figure.html', auto_open=True)
-        return self.fig
-        
-    def CMIP5_prediction(self):
-        self.fig = make_subplots(rows=1, cols=2,
-                            horizontal_spacing=0.15, vertical_spacing=0.1)
-        self.Model = CMIP.loc['HadGEM2-ES']
-        tatm_Had, _, = self.Run_sim()
-        self.Model = CMIP.loc['FGOALS-s2']
-        tatm_FGO ,_, =self.Run_sim()
-        self.Model = CMIP.loc['CSIRO-Mk3.6.0']
-        tatm_CSI ,_, =self.Run_sim()
-        self.Model = CMIP.loc['IPSL-CM5A-LR']
-        tatm_IPS ,_, =self.Run_sim()
-        self.Model = CMIP.loc['BNU-ESM']
-        tatm_BNU ,_, =self.Run_sim()
-        self.Model = CMIP.loc['CanESM2']
-        tatm_Can ,_, =self.Run_sim()
-        self.Model = CMIP.loc['MPI-ESM-LR']
-        tatm_MPI ,_, =self.Run_sim()
-        self.Model = CMIP.loc['MMM_CMIP5']
-        tatm_MMM ,_, =self.Run_sim()
-        self.Model = CMIP.loc['CNRM-CM5']
-        tatm_CNRM ,_, =self.Run_sim()
-        self.Model = CMIP.loc['CCSM4']
-        tatm_CC ,_, =self.Run_sim()
-        self.Model = CMIP.loc['BCC-CSM1-1']
-        tatm_BCC ,_, =self.Run_sim()
-        self.Model = CMIP.loc['NorESM1-M']
-        tatm_Nor ,_, =self.Run_sim()
-        self.Model = CMIP.loc['MIROC5']
-        tatm_MIR ,_, =self.Run_sim()
-        self.Model = CMIP.loc['MRI-CGCM3']
-        tatm_MRI ,_, =self.Run_sim()
-        self.Model = CMIP.loc['GFDL-ESM2M']
-        tatm_GFD ,_, =self.Run_sim()
-        self.Model = CMIP.loc['GISS-E2-R']
-        tatm_GISS ,_, =self.Run_sim()
-        self.Model = CMIP.loc['INM-CM4']
-        tatm_INM ,_, =self.Run_sim()
-        
-        
+    @staticmethod
+    def CMIP_results(emission, dt = 1, Model_names = None):
+        """Tatm of all (or the given) CMIP models as a ResultTable."""
+        # all models are stepped together by the ensemble emulator; the
+        # (years, models) array it returns is used without copying
+        if Model_names is None:
+            Model_names = CMIP.index.tolist()
+        tatm, _ = Temp_ensemble(emission, Model_names, dt)
+        return ResultTable(tatm, simulation_years(tatm.shape[0] - 1, dt), Model_names, 'Tatm')
+    
+    @staticmethod
+    def Temp_CMIP(emission, dt = 1):
+        results = Emulator.CMIP_results(emission, dt)
+        with Instrumentation.region('Temp_CMIP.assemble'):
+            df = results.to_frame()
 
-        
-        x_year = np.arange(self.start_year, self.end_year, self.dt)
-        # Create the first trace with the first y-axis
-        #fig = go.Figure()
-        width = 0.7
-        self.fig.update_annotations(font_size=30)
-        self.fig.add_trace(go.Scatter(x=x_year, y = self.emission, mode='lines', name='Emissions' ,
-                                    
-                                      showlegend= False),
-                           row = 1, col = 1)
-
-        # Create the second trace with the second y-axis
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Had, mode='lines', name="HadGEM2-ES",
-                                     line=dict(width=width) ),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_FGO, mode='lines', name="FGOALS-s2",
-                                     line=dict(width=width) ),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CSI, mode='lines', name="CSIRO-Mk3.6.0",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_IPS, mode='lines', name="IPSL-CM5A-LR",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_BNU, mode='lines', name="BNU-ESM",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Can, mode='lines', name="CanESM2",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MPI, mode='lines', name="MPI-ESM-LR",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MMM, mode='lines', name="MMM_CMIP5",
-                                      line=dict(dash = 'dash', width=5)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CNRM, mode='lines', name="CNRM-CM5",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CC, mode='lines', name="CCSM4",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_BCC, mode='lines', name="BCC-CSM1-1",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Nor, mode='lines', name="NorESM1-M",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MIR, mode='lines', name="MIROC5",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MRI, mode='lines', name="MRI-CGCM3",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_GFD, mode='lines', name="GFDL-ESM2M",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_GISS, mode='lines', name="GISS-E2-R",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        self.fig.add_trace(go.Scatter(x=x_year, y = tatm_INM, mode='lines', name="INM-CM4",
-                                      line=dict(width=width)),
-                           row = 1, col = 2)
-        
-        
-        self.fig.update_yaxes(title_text="Emission (Gigaton Carbon/year)",
-                         range=[np.min(self.emission)-1,np.max(self.emission)+1],
-                         title_standoff=25, title_font=dict(size=25), row = 1, col =1)
-        self.fig.update_yaxes(title_text="Global surface temperature anomaly (°C)",
-                         range = [0,self.tatm_max+1],
-                         title_standoff=25, title_font=dict(size=25), row = 1, col =2)
-        self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =1)
-        self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =2)
-        
-        self.fig.update_layout(
-            title_text = '',
-            title=dict(
-                font=dict(
-                    size=25  # Adjust the font size here
-                    )
-                ),
-            annotations=[
-        dict(text="Emission data", x=0.2, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25)),
-        dict(text="Temperature anomaly prediction with CMIP5 models", x=1, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25))
-    ]
-            )
-        
+        return df
 
-    # Update the color scale
-        self.fig.update_layout(colorway=self.custom_colors)
 
+# CMIP columns used by the temperature and forcing modules
+TEMP_PARAMETERS = ('c1', 'c3', 'c4', 'lambda', 'ECS', 'F2xco2', 'Tatm0', 'Tocean0')
 
-        # # Show the plot
-        # self.fig.write_html('first_figure.html', auto_open=True)
-        return self.fig
-        
-        Temp_CMIP5 = {
-            'tatm_had':tatm_Had,
-            'tatm_FGO':tatm_FGO,
-            'tatm_CSI':tatm_CSI,
-            'tatm_IPS':tatm_IPS,
-            'tatm_BNU':tatm_BNU,
-            'tatm_Can':tatm_Can,
-            'tatm_MPI':tatm_MPI,
-            'tatm_MMM':tatm_MMM,
-            'tatm_CNRM':tatm_CNRM,
-            'tatm_CC':tatm_CC,
-            'tatm_BCC':tatm_BCC,
-            'tatm_Nor':tatm_Nor,
-            'tatm_MIR':tatm_MIR,
-            'tatm_MRI':tatm_MRI,
-            'tatm_GFD':tatm_GFD,
-            'tatm_GISS':tatm_GISS,
-            'tatm_INM':tatm_INM,
-            }
-        return(Temp_CMIP5)
-        
-        
-        
-    def CMIP6_prediction(self):
-         self.fig = make_subplots(rows=1, cols=2,
-                            horizontal_spacing=0.15, vertical_spacing=0.1)
-         self.Model = CMIP.loc['CNRM-CM6-1']
-         tatm_Had, _, = self.Run_sim()
-         self.Model = CMIP.loc['CNRM-ESM2-1']
-         tatm_FGO ,_, =self.Run_sim()
-         self.Model = CMIP.loc['ACCESS-ESM1-5']
-         tatm_CSI ,_, =self.Run_sim()
-         self.Model = CMIP.loc['CNRM-CM6-1-HR']
-         tatm_IPS ,_, =self.Run_sim()
-         self.Model = CMIP.loc['SAM0-UNICON']
-         tatm_BNU ,_, =self.Run_sim()
-         self.Model = CMIP.loc['CMCC-CM2-SR5']
-         tatm_Can ,_, =self.Run_sim()
-         self.Model = CMIP.loc['BCC-ESM1']
-         tatm_MPI ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MMM_CMIP6']
-         tatm_MMM ,_, =self.Run_sim()
-         self.Model = CMIP.loc['AWI-CM-1-1-MR']
-         tatm_CNRM ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MRI-ESM2-0']
-         tatm_CC ,_, =self.Run_sim()
-         self.Model = CMIP.loc['NorCPM1']
-         tatm_BCC ,_, =self.Run_sim()
-         self.Model = CMIP.loc['GISS-E2-1-H']
-         tatm_Nor ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MPI-ESM1-2-HR']
-         tatm_MIR ,_, =self.Run_sim()
-         self.Model = CMIP.loc['BCC-CSM2-MR']
-         tatm_MRI ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MPI-ESM1-2-LR']
-         tatm_GFD ,_, =self.Run_sim()
-         self.Model = CMIP.loc['FGOALS-g3']
-         tatm_GISS ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MIROC6']
-         tatm_INM ,_, =self.Run_sim()
-         self.Model = CMIP.loc['MIROC-ES2L']
-         tatm_CMIP60 ,_, =self.Run_sim()
-         self.Model = CMIP.loc['GISS-E2-1-G']
-         tatm_CMIP61 ,_, =self.Run_sim()
-         self.Model = CMIP.loc['CAMS-CSM1-0']
-         tatm_CMIP62 ,_, =self.Run_sim()
-         self.Model = CMIP.loc['GISS-E2-2-G']
-         tatm_CMIP63 ,_, =self.Run_sim()
-         
-         
-
-         width = 0.7
-         x_year = np.arange(self.start_year, self.end_year, self.dt)
-         # Create the first trace with the first y-axis
-         #fig = go.Figure()
-         self.fig.update_annotations(font_size=30)
-         self.fig.add_trace(go.Scatter(x=x_year, y = self.emission, mode='lines', name='Emissions' ,
-                                     
-                                       showlegend= False),
-                            row = 1, col = 1)
-
-         # Create the second trace with the second y-axis
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Had, mode='lines', name="CNRM-CM6-1",
-                                    line=dict(width=width)  ),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_FGO, mode='lines', name="CNRM-ESM2-1",
-                                      line=dict(width=width) ),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CSI, mode='lines', name="ACCESS-ESM1-5",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_IPS, mode='lines', name="CNRM-CM6-1-HR",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_BNU, mode='lines', name="SAM0-UNICON",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Can, mode='lines', name="CMCC-CM2-SR5",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MPI, mode='lines', name="BCC-ESM1",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MMM, mode='lines', name="MMM_CMIP6",
-                                       line = dict(dash ='dash', width =5)),
-                            
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CNRM, mode='lines', name="AWI-CM-1-1-MR",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CC, mode='lines', name="MRI-ESM2-0",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_BCC, mode='lines', name="NorCPM1",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_Nor, mode='lines', name="GISS-E2-1-H",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MIR, mode='lines', name="MPI-ESM1-2-HR",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_MRI, mode='lines', name="BCC-CSM2-MR",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_GFD, mode='lines', name="MPI-ESM1-2-LR",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_GISS, mode='lines', name="FGOALS-g3",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_INM, mode='lines', name="MIROC6",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CMIP60, mode='lines', name="MIROC-ES2L",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CMIP61, mode='lines', name="GISS-E2-1-G",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CMIP62, mode='lines', name="CAMS-CSM1-0",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         self.fig.add_trace(go.Scatter(x=x_year, y = tatm_CMIP63, mode='lines', name="GISS-E2-2-G",
-                                       line=dict(width=width)),
-                            row = 1, col = 2)
-         
-         
-         self.fig.update_yaxes(title_text="Emission (Gigaton Carbon/year)",
-                          range=[np.min(self.emission)-1,np.max(self.emission)+1],
-                          title_standoff=25, title_font=dict(size=25), row = 1, col =1)
-         self.fig.update_yaxes(title_text="Global surface temperature anomaly (°C)",
-                          range = [0,self.tatm_max+1],
-                          title_standoff=25, title_font=dict(size=25), row = 1, col =2)
-         self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =1)
-         self.fig.update_xaxes(title_text ='Time', title_standoff =25,title_font=dict(size=25), row = 1, col =2)
-         
-         self.fig.update_layout(
-             title_text = '',
-             title=dict(
-                 font=dict(
-                     size=25  # Adjust the font size here
-                     )
-                 ),
-             annotations=[
-         dict(text="Emission data", x=0.2, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25)),
-         dict(text="Temperature anomaly prediction with CMIP6 models", x=1, y=1.05, xref="paper", yref="paper", showarrow=False, font=dict(size=25))
-     ]
-             )
-            
-
-        # Update the color scale
-         self.fig.update_layout(colorway=self.custom_colors)
-
-
-        #     # Show the plot
-        #  self.fig.write_html('first_figure.html', auto_open=True)
-        # return self.fig
-         
-         Temp_CMIP6 = {
-             'tatm_had':tatm_Had,
-             'tatm_FGO':tatm_FGO,
-             'tatm_CSI':tatm_CSI,
-             'tatm_IPS':tatm_IPS,
-             'tatm_BNU':tatm_BNU,
-             'tatm_Can':tatm_Can,
-             'tatm_MPI':tatm_MPI,
-             'tatm_MMM':tatm_MMM,
-             'tatm_CNRM':tatm_CNRM,
-             'tatm_CC':tatm_CC,
-             'tatm_BCC':tatm_BCC,
-             'tatm_Nor':tatm_Nor,
-             'tatm_MIR':tatm_MIR,
-             'tatm_MRI':tatm_MRI,
-             'tatm_GFD':tatm_GFD,
-             'tatm_GISS':tatm_GISS,
-             'tatm_INM':tatm_INM,
-             'tatm_CMIP60':tatm_CMIP60,
-             'tatm_CMIP61':tatm_CMIP61,
-             'tatm_CMIP62 ':tatm_CMIP62 ,
-             'tatm_CMIP63':tatm_CMIP63
-             
-             }
-         return(Temp_CMIP6)
-            
-        
-        
-        
-   
-        
-    
-    
-    def Temp_CMIP(emission):
-        Temp = []
-        for model in CMIP.index.tolist():
-            temp_Model = Emulator(Carbon_emission=emission, Model_name=model)
-            tatm,_ = temp_Model.Run_sim()
-            Temp_data = {
-                'Model': model,
-                'Temperature': tatm}
-            Temp.append(Temp_data)
-        
-        new_row = {'Model':'Year', 'Temperature':np.arange(2020, 2102,1)}
-        Temp.append(new_row)
-        Temp_df = pd.DataFrame(Temp)
-        df = pd.DataFrame(Temp_df.Temperature.tolist(), index= Temp_df.Model).T
 
-        return df
-            
+def model_parameters(Model_names = None):
+    """TEMP_PARAMETERS of the given CMIP models as a dict of (n_models,) arrays."""
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    Models = CMIP.loc[list(Model_names)]
+    return {k: np.array(Models[k], dtype=float) for k in TEMP_PARAMETERS}
 
-    
 
+class EnsembleEmulator:
+    """Run several CMIP models at once.
+
+    Same time stepping as Emulator.Run_sim, but the temperature parameters
+    are (n_models,) arrays so every model is advanced in a single pass over
+    the years. The carbon cycle uses the 'MMM' parameters for every model,
+    so it is only computed once.
+
+    Carbon_emission may also be a 2-D (n_scenarios, n_periods) matrix, in
+    which case carbon states have shape (n_scenarios, 1) and temperature
+    states (n_scenarios, n_models).
+
+    initial_state optionally overrides the starting values with a dict of
+    'M_at', 'M_up', 'M_lo', 'Tatm' and/or 'Tocean' arrays, e.g. to resume
+    from a checkpoint of an earlier run.
+
+    Model_params replaces the CMIP lookup with a mapping of the
+    TEMP_PARAMETERS columns to (n_models,) arrays (e.g. perturbed
+    parameters); Model_names are then only labels.
+
+    paired = True with a 2-D emission runs scenario s with model s only
+    (n_scenarios models, e.g. one candidate path per model); all states
+    then have shape (n_scenarios,).
+
+    run_sim_order = False replaces the ocean update of Emulator.Run_sim,
+    Tocean' = Tatm + dt*c4*(Tocean-Tatm), by the two-box update
+    Tocean' = Tocean + dt*c4*(Tatm-Tocean), which converges as dt shrinks
+    (see TimeStepping).
+    """
+    def __init__(self, Carbon_emission = [], Model_names = None, dt = 1, Forcing_factor = 1.1,
+                 initial_state = None, Model_params = None, paired = False, run_sim_order = True):
+        self.start_year = 2020
+        self.emission = np.asarray(Carbon_emission, dtype=float)
+        self.dt = dt
+        self.end_year = self.start_year + self.emission.shape[-1]*self.dt
+        if Model_params is not None:
+            self.Models = {k: np.asarray(Model_params[k], dtype=float) for k in TEMP_PARAMETERS}
+            if Model_names is None:
+                Model_names = [f'model_{j}' for j in range(len(self.Models['c1']))]
+            self.Model_names = list(Model_names)
+        else:
+            if Model_names is None:
+                Model_names = CMIP.index.tolist()
+            self.Model_names = list(Model_names)
+            self.Models = CMIP.loc[self.Model_names]
+        self.CarbonModel = Carbon.loc['MMM']
+        self.Forcing_factor = Forcing_factor
+        self.initial_state = {} if initial_state is None else initial_state
+        self.paired = paired
+        self.run_sim_order = run_sim_order
+        if paired and (self.emission.ndim != 2 or self.emission.shape[0] != len(self.Model_names)):
+            raise ValueError('paired runs need a 2-D emission with one row per model')
+
+    def TempParameter(self):
+        num_periods = int(round((self.end_year-self.start_year)/self.dt))
+        self.TempClass, self.CarbonClass = self.build(num_periods)
+
+    def build(self, num_periods):
+        """Return a new (DICETemp, CarbonCycle) pair for a horizon of num_periods."""
+        Models = self.Models
+        if self.paired:
+            carbon_shape = temp_shape = (self.emission.shape[0],)
+        elif self.emission.ndim == 2:
+            n_scenarios = self.emission.shape[0]
+            carbon_shape = (n_scenarios, 1)
+            temp_shape = (n_scenarios, len(self.Model_names))
+        else:
+            carbon_shape = ()
+            temp_shape = (len(self.Model_names),)
+        para_Temp = {'c1': Models['c1'],
+                     'c3': Models['c3'],
+                     'c4': Models['c4'],
+                     'ECS': Models['ECS'],
+                     'lambda': Models['lambda']}
+        para_Forcing = {'F2xco2': Models['F2xco2'],
+                        'Meq_at': self.CarbonModel['Meq_at'],
+                        'Forc_fac': self.Forcing_factor}
+        state = self.initial_state
+        initial_Temp = {'tatm0': np.broadcast_to(state.get('Tatm', Models['Tatm0']), temp_shape),
+                        'tocean0': np.broadcast_to(state.get('Tocean', Models['Tocean0']), temp_shape)}
+        para_Carbon = {'b12': self.CarbonModel['b12'], 'b23': self.CarbonModel['b23'],
+                       'Meq_at': self.CarbonModel['Meq_at'],
+                       'Meq_up': self.CarbonModel['Meq_up'],
+                       'Meq_lo': self.CarbonModel['Meq_lo']}
+        initial_Carbon_mass = {'M0_at': np.broadcast_to(state.get('M_at', self.CarbonModel['M0_at']), carbon_shape),
+                               'M0_up': np.broadcast_to(state.get('M_up', self.CarbonModel['M0_up']), carbon_shape),
+                               'M0_lo': np.broadcast_to(state.get('M_lo', self.CarbonModel['M0_lo']), carbon_shape)}
+        TempClass = DICETemp(para_Temp, initial_Temp, para_Forcing, dt = self.dt,
+                             horizon = num_periods, shape = temp_shape)
+        CarbonClass = CarbonCycle(para_Carbon, initial_Carbon_mass, dt = self.dt,
+                                  horizon = num_periods, shape = carbon_shape)
+        return TempClass, CarbonClass
+
+    def clear(self):
+        self.TempParameter()
+        self.CarbonClass.clear()
+        self.TempClass.clear()
 
+    def Run_sim(self):
+        """Return (tatm, tocean), each of shape (n_periods+1, n_models).
 
-      
+        With a 2-D emission matrix the shape is
+        (n_periods+1, n_scenarios, n_models), or (n_periods+1, n_scenarios)
+        for a paired run.
+        """
+        self.clear()
+        emission = self.emission
+        num_periods = int(round((self.end_year-self.start_year)/self.dt))
 
+        for i_step in range(num_periods):
+            if self.paired:
+                carbon_emission = emission[:, i_step]*self.dt
+            elif emission.ndim == 2:
+                carbon_emission = emission[:, i_step, None]*self.dt
+            else:
+                carbon_emission = emission[i_step]*self.dt
+            M_at, M_up, M_lo = self.CarbonClass.getLast()
+            self.TempClass.updateForcing(M_at)
+            tatm, tocean, forcing = self.TempClass.getLast()
+            self.TempClass.updateSurTemp(tatm, tocean, forcing)
+            if self.run_sim_order:
+                # argument order kept identical to Emulator.Run_sim
+                self.TempClass.updateOceanTemp(tatm, tocean)
+            else:
+                self.TempClass.updateOceanTemp(tocean, tatm)
+            self.CarbonClass.updateCarbon(carbon_emission, M_at, M_up, M_lo)
+        tatm, tocean, _ = self.TempClass.getFinal()
+        return(np.asarray(tatm['Tatm']), np.asarray(tocean['Tocean']))
+
+    def iter_sim(self, emission = None):
+        """Yield a StepRecord per year for all models, see iter_steps.
+
+        Temperatures and forcing are (n_models,) arrays. If the emulator was
+        built with a 2-D emission matrix, the items of emission must be
+        (n_scenarios,) arrays and the record fields carry the scenario axis
+        first, as in Run_sim. emission defaults to the emulator's own.
+        """
+        if emission is None:
+            emission = self.emission.T if self.emission.ndim == 2 else self.emission
+        if self.emission.ndim == 2 and not self.paired:
+            emission = (np.asarray(e, dtype=float)[:, None] for e in emission)
+        TempClass, CarbonClass = self.build(1)
+        return iter_steps(TempClass, CarbonClass, emission, self.dt, self.start_year,
+                          self.run_sim_order)
+
+    def Jacobian(self, parameters = Sensitivity.PARAMETERS):
+        """Sensitivities of Tatm of the last Run_sim for every model (and
+        scenario), see Sensitivity.jacobian."""
+        return Sensitivity.jacobian(self.TempClass, self.CarbonClass, parameters,
+                                    self.run_sim_order)
+
+    def getFinal(self):
+        """All histories of the last run as views with time on the last axis."""
+        tatm, tocean, forcing = self.TempClass.getFinal()
+        M_at, M_up, M_lo = self.CarbonClass.getFinal()
+        return {'Tatm': np.moveaxis(tatm['Tatm'], 0, -1),
+                'Tocean': np.moveaxis(tocean['Tocean'], 0, -1),
+                'Forcing': np.moveaxis(forcing['Forcing'], 0, -1),
+                'M_at': np.moveaxis(M_at['M_at'], 0, -1),
+                'M_up': np.moveaxis(M_up['M_up'], 0, -1),
+                'M_lo': np.moveaxis(M_lo['M_lo'], 0, -1)}
+
+
+# shared by Temp_CMIP and every other caller of Temp_ensemble
+simulation_cache = SimulationCache()
+simulation_checkpoints = CheckpointStore()
+
+
+def Run_resume(emission, Model_names, dt = 1, Forcing_factor = 1.1,
+               checkpoints = simulation_checkpoints):
+    """Run one emission path, resuming from the closest recent run.
+
+    The recent run with the longest common emission prefix that covered
+    all of Model_names is looked up in checkpoints; its states at the first
+    differing step are the starting point, so only the remaining steps are
+    simulated. The full run is then stored as a new checkpoint. Returns
+    (tatm, tocean) of shape (n_periods+1, n_models), identical to a run
+    from the start.
+    """
+    emission = np.asarray(emission, dtype=float)
+    num_periods = emission.shape[-1]
+    found = checkpoints.find(emission, Model_names, dt, Forcing_factor)
+    if found is None:
+        ensemble = EnsembleEmulator(emission, Model_names, dt, Forcing_factor)
+        ensemble.Run_sim()
+        states = {k: np.moveaxis(v, -1, 0) for k, v in ensemble.getFinal().items()
+                  if k != 'Forcing'}
+    else:
+        step, prefix = found
+        if step == num_periods:
+            states = prefix
+        else:
+            start = {k: v[-1] for k, v in prefix.items()}
+            ensemble = EnsembleEmulator(emission[step:], Model_names, dt, Forcing_factor,
+                                        initial_state=start)
+            ensemble.Run_sim()
+            states = {k: np.concatenate([prefix[k], np.moveaxis(v, -1, 0)[1:]])
+                      for k, v in ensemble.getFinal().items() if k != 'Forcing'}
+    checkpoints.add(emission, Model_names, dt, Forcing_factor, states)
+    return(states['Tatm'], states['Tocean'])
+
+
+def Temp_ensemble(emission, Model_names = None, dt = 1, Forcing_factor = 1.1,
+                  cache = simulation_cache):
+    """(tatm, tocean) of shape (n_periods+1, n_models) for one emission path.
+
+    Models already in the cache for this emission path, dt and forcing
+    factor are reused; only the missing ones are run, together, by
+    Run_resume, which also skips the steps shared with a recent run. Pass
+    cache=None to bypass both.
+    """
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    Model_names = list(Model_names)
+    if cache is None:
+        return EnsembleEmulator(emission, Model_names, dt, Forcing_factor).Run_sim()
+    digest = emission_digest(emission)
+    keys = [cache.key(digest, name, dt, Forcing_factor) for name in Model_names]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        # a model listed twice is only run once
+        missing_names = list(dict.fromkeys(Model_names[i] for i in missing))
+        tatm, tocean = Run_resume(emission, missing_names, dt, Forcing_factor)
+        computed = {}
+        for j, name in enumerate(missing_names):
+            computed[name] = (tatm[:, j].copy(), tocean[:, j].copy())
+            cache.put(cache.key(digest, name, dt, Forcing_factor), computed[name])
+        for i in missing:
+            results[i] = computed[Model_names[i]]
+    tatm = np.stack([r[0] for r in results], axis=-1)
+    tocean = np.stack([r[1] for r in results], axis=-1)
+    return(tatm, tocean)
+
+
+SWEEP_VARIABLES = ('Tatm', 'Tocean', 'Forcing', 'M_at', 'M_up', 'M_lo')
+
+
+def iter_sweep(emissions, Model_names = None, dt = 1, chunk_size = 1024):
+    """Run a (n_scenarios, n_periods) emission matrix against a list of models.
+
+    Scenarios are processed chunk_size at a time; for every chunk this
+    yields (start, stop, results) where results maps each name in
+    SWEEP_VARIABLES to an array with time on the last axis:
+    (chunk, n_models, n_periods+1) for temperatures,
+    (chunk, n_models, n_periods) for forcing and
+    (chunk, 1, n_periods+1) for the carbon reservoirs, which do not
+    depend on the climate model.
+    """
+    emissions = np.atleast_2d(np.asarray(emissions, dtype=float))
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be a positive integer')
+    n_scenarios = emissions.shape[0]
+    for start in range(0, n_scenarios, chunk_size):
+        stop = min(start + chunk_size, n_scenarios)
+        ensemble = EnsembleEmulator(Carbon_emission=emissions[start:stop],
+                                    Model_names=Model_names, dt=dt)
+        ensemble.Run_sim()
+        yield start, stop, ensemble.getFinal()
+
+
+def Run_sweep(emissions, Model_names = None, dt = 1, chunk_size = 1024,
+              variables = SWEEP_VARIABLES):
+    """Assemble iter_sweep chunks into (scenario, model, year) cubes.
+
+    Only the requested variables are kept, so peak memory is the output
+    cubes plus one chunk of working state. Carbon reservoirs are returned
+    as read-only broadcast views over the model axis.
+    """
+    emissions = np.atleast_2d(np.asarray(emissions, dtype=float))
+    n_scenarios, num_periods = emissions.shape
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    n_models = len(Model_names)
+    out = {}
+    for name in variables:
+        if name not in SWEEP_VARIABLES:
+            raise KeyError(f"unknown sweep variable '{name}'")
+        n_years = num_periods if name == 'Forcing' else num_periods + 1
+        n_cols = 1 if name.startswith('M_') else n_models
+        out[name] = np.empty((n_scenarios, n_cols, n_years))
+    for start, stop, results in iter_sweep(emissions, Model_names, dt, chunk_size):
+        for name in out:
+            out[name][start:stop] = results[name]
+    for name in out:
+        if name.startswith('M_'):
+            out[name] = np.broadcast_to(out[name], (n_scenarios, n_models, out[name].shape[-1]))
+    return out
+
+
+if os.environ.get('EMULATOR_METRICS', '') not in ('', '0'):
+    Instrumentation.enable()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Headless HTTP service for the emulator.
+
+    python EmulatorService.py --port 8080
+
+    POST /simulate  {"emission": [...], "models": ["MIROC6", ...], "dt": 1}
+                    -> {"Year": [...], "Model": [...], "Tatm": [[...], ...]}
+    GET  /metrics   request counts, batching and p50/p99 latencies
+    GET  /health
+
+Requests arriving within window seconds of each other are micro-batched:
+paths of the same length, dt and forcing factor are stacked into one 2-D
+EnsembleEmulator run over the union of their models. Identical requests
+that are still in flight share one result. The simulation runs on an
+executor, so the event loop only parses and answers requests.
+
+EmulatorService is an ASGI application (service = EmulatorService(); run
+with any ASGI server) and serve() runs it on a minimal asyncio HTTP/1.1
+server from the standard library.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+
+import Instrumentation
+from EmulatorCore import CMIP, EnsembleEmulator
+from Results import simulation_years
+from SimulationCache import emission_digest
+
+_Request = namedtuple('_Request', ['key', 'emission', 'Model_names', 'dt', 'Forcing_factor', 'future'])
+
+
+def _encode(status, payload):
+    # NaN or inf in a result would give a body that is not valid JSON
+    try:
+        return status, json.dumps(payload, allow_nan=False).encode()
+    except ValueError:
+        return 500, json.dumps({'error': 'the result is not finite'}).encode()
+
+
+def _run_batch(emissions, Model_names, dt, Forcing_factor):
+    # executed on the worker pool
+    tatm, _ = EnsembleEmulator(emissions, Model_names, dt, Forcing_factor).Run_sim()
+    return tatm
+
+
+class EmulatorService:
+    def __init__(self, window = 0.005, max_batch = 256, workers = None, processes = False):
+        self.window = window
+        self.max_batch = max_batch
+        workers = workers or os.cpu_count() or 1
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.models = set(CMIP.index.tolist())
+        self._pending = []
+        self._inflight = {}
+        self._flush_handle = None
+        # the loop only keeps weak references to tasks
+        self._tasks = set()
+        # latencies are kept apart from Instrumentation's shared registry,
+        # which Instrumentation.reset() clears
+        self.registry = Instrumentation.Registry()
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_requests = 0
+
+    async def simulate(self, emission, Model_names = None, dt = 1, Forcing_factor = 1.1):
+        """Tatm of shape (n_periods+1, n_models) for one emission path."""
+        emission = np.asarray(emission, dtype=float)
+        if emission.ndim != 1 or emission.size == 0 or not np.all(np.isfinite(emission)):
+            raise ValueError('emission must be a non-empty list of numbers')
+        if not (np.isfinite(dt) and dt > 0):
+            raise ValueError('dt must be a positive finite number')
+        if not np.isfinite(Forcing_factor):
+            raise ValueError('Forcing_factor must be a finite number')
+        if Model_names is None:
+            Model_names = CMIP.index.tolist()
+        if isinstance(Model_names, (str, bytes)) or not isinstance(Model_names, (list, tuple)):
+            raise ValueError('models must be a list of model names, e.g. ["MIROC6"]')
+        Model_names = tuple(Model_names)
+        unknown = [name for name in Model_names if name not in self.models]
+        if unknown or not Model_names:
+            raise ValueError(f'unknown models {unknown}' if unknown else 'no models given')
+        key = (emission_digest(emission), Model_names, float(dt), float(Forcing_factor))
+        self.requests += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[key] = future
+            self._pending.append(_Request(key, emission, Model_names, float(dt),
+                                          float(Forcing_factor), future))
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        # a cancelled caller must not cancel the result shared with others
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        groups = {}
+        for request in pending:
+            groups.setdefault((request.emission.shape[0], request.dt, request.Forcing_factor),
+                              []).append(request)
+        for group in groups.values():
+            task = asyncio.ensure_future(self._run_group(group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_group(self, group):
+        emissions = np.stack([request.emission for request in group])
+        Model_names = list(dict.fromkeys(name for request in group for name in request.Model_names))
+        dt, Forcing_factor = group[0].dt, group[0].Forcing_factor
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            tatm = await loop.run_in_executor(self.executor, _run_batch, emissions,
+                                              Model_names, dt, Forcing_factor)
+        except Exception as exc:
+            for request in group:
+                self._inflight.pop(request.key, None)
+                if not request.future.done():
+                    request.future.set_exception(exc)
+            return
+        self.registry.record('service.batch', time.perf_counter() - start)
+        self.batches += 1
+        self.batched_requests += len(group)
+        column = {name: j for j, name in enumerate(Model_names)}
+        for s, request in enumerate(group):
+            self._inflight.pop(request.key, None)
+            if not request.future.done():
+                request.future.set_result(tatm[:, s, [column[name] for name in request.Model_names]])
+
+    def metrics(self):
+        latencies = {name[len('service.'):]: values
+                     for name, values in self.registry.snapshot().items()
+                     if name.startswith('service.')}
+        return {'requests': self.requests,
+                'coalesced': self.coalesced,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_requests/self.batches if self.batches else 0.0,
+                'in_flight': len(self._inflight),
+                'latency': latencies}
+
+    async def handle(self, method, path, body):
+        """Answer one request; returns (status, JSON-serialisable payload)."""
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics()
+        if path != '/simulate':
+            return 404, {'error': f'no route {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        start = time.perf_counter()
+        try:
+            request = json.loads(body or b'{}')
+            if 'emission' not in request:
+                raise ValueError("missing field 'emission'")
+            emission = request['emission']
+            Model_names = request.get('models')
+            dt = float(request.get('dt', 1))
+            Forcing_factor = float(request.get('Forcing_factor', 1.1))
+            tatm = await self.simulate(emission, Model_names, dt, Forcing_factor)
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            return 400, {'error': str(exc)}
+        Model_names = CMIP.index.tolist() if Model_names is None else list(Model_names)
+        payload = {'Year': simulation_years(tatm.shape[0] - 1, dt).tolist(),
+                   'Model': Model_names,
+                   'Tatm': tatm.T.tolist()}
+        self.registry.record('service.simulate', time.perf_counter() - start)
+        return 200, payload
+
+    async def __call__(self, scope, receive, send):
+        # ASGI entry point
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.close()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        body = b''
+        more = True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+        status, payload = await self.handle(scope['method'], scope['path'], body)
+        status, data = _encode(status, payload)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(data)).encode())]})
+        await send({'type': 'http.response.body', 'body': data})
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def _serve_connection(service, reader, writer):
+    try:
+        request_line = await reader.readline()
+        if not request_line:
+            return
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        status, payload = await service.handle(method, target.split('?', 1)[0], body)
+    except (ValueError, asyncio.IncompleteReadError):
+        status, payload = 400, {'error': 'malformed request'}
+    except ConnectionError:
+        writer.close()
+        return
+    status, data = _encode(status, payload)
+    head = (f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+            'Connection: close\r\n\r\n')
+    try:
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host = '127.0.0.1', port = 8080, service = None, ready = None):
+    """Serve an EmulatorService over HTTP/1.1 until cancelled.
+
+    ready, if given, is an asyncio.Event set once the port is listening.
+    """
+    if service is None:
+        service = EmulatorService()
+    server = await asyncio.start_server(lambda r, w: _serve_connection(service, r, w), host, port)
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--window-ms', type=float, default=5.0,
+                        help='micro-batching window in milliseconds (default 5)')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--processes', action='store_true',
+                        help='run simulations in worker processes instead of threads')
+    args = parser.parse_args(argv)
+    service = EmulatorService(args.window_ms/1000, args.max_batch, args.workers, args.processes)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in call counters and timers for the emulator.
+
+enable() wraps the methods listed in TARGETS with a timer and disable()
+puts the original functions back, so nothing is added to the hot path
+while instrumentation is off. Temp_CMIP's DataFrame assembly is timed with
+region(), which returns a shared no-op context manager when disabled.
+Setting the environment variable EMULATOR_METRICS=1 enables it when
+EmulatorCore is imported.
+
+Module-level functions in TARGETS (Temp_ensemble, Run_sweep) are also
+replaced in the already imported modules of this package that bound them
+by name (from EmulatorCore import Run_sweep); a module imported after
+enable() binds the timed function and keeps it after disable().
+
+    import Instrumentation
+    Instrumentation.enable()
+    ...
+    Instrumentation.snapshot()['CarbonCycle.updateCarbon']
+    # {'count': 3239, 'total_s': ..., 'p50_s': ..., 'p99_s': ...}
+
+The module-level record(), reset() and snapshot() use a shared Registry;
+code keeping its own latencies (e.g. EmulatorService) creates another
+Registry so that reset() does not clear them.
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+# (module, class or None, attribute) of every instrumented callable
+TARGETS = (
+    ('EmulatorCore', 'Emulator', 'TempParameter'),
+    ('EmulatorCore', 'Emulator', 'Run_sim'),
+    ('EmulatorCore', 'Emulator', 'Temp_CMIP'),
+    ('EmulatorCore', 'EnsembleEmulator', 'TempParameter'),
+    ('EmulatorCore', 'EnsembleEmulator', 'Run_sim'),
+    ('EmulatorCore', None, 'Temp_ensemble'),
+    ('EmulatorCore', None, 'Run_sweep'),
+    ('CarbonModule', 'CarbonCycle', 'updateCarbon'),
+    ('TempModule', 'DICETemp', 'updateForcing'),
+    ('TempModule', 'DICETemp', 'updateSurTemp'),
+    ('TempModule', 'DICETemp', 'updateOceanTemp'),
+    ('ParameterStore', 'ParameterStore', '_load'),
+)
+
+# latencies kept per name for the percentiles
+RESERVOIR = 10000
+
+_lock = threading.Lock()
+_patched = {}
+_null = nullcontext()
+
+
+class Registry:
+    """Call counts and latencies per name, safe to share between threads."""
+    def __init__(self, reservoir = RESERVOIR):
+        self.reservoir = reservoir
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+        self._samples = {}
+        self._max = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            if name not in self._counts:
+                self._counts[name] = 0
+                self._totals[name] = 0.0
+                self._samples[name] = deque(maxlen=self.reservoir)
+                self._max[name] = seconds
+            self._counts[name] += 1
+            self._totals[name] += seconds
+            self._samples[name].append(seconds)
+            # the reservoir only keeps the latest samples, the maximum is exact
+            self._max[name] = max(self._max[name], seconds)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._totals.clear()
+            self._samples.clear()
+            self._max.clear()
+
+    def snapshot(self):
+        """Call count, total/mean time and latency percentiles per name."""
+        with self._lock:
+            items = [(name, self._counts[name], self._totals[name], np.array(self._samples[name]),
+                      self._max[name])
+                     for name in self._counts]
+        metrics = {}
+        for name, count, total, samples, maximum in items:
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            metrics[name] = {'count': count,
+                             'total_s': total,
+                             'mean_s': total/count,
+                             'p50_s': float(p50),
+                             'p90_s': float(p90),
+                             'p99_s': float(p99),
+                             'max_s': float(maximum)}
+        return metrics
+
+
+_registry = Registry()
+
+
+def is_enabled():
+    return bool(_patched)
+
+
+def record(name, seconds):
+    _registry.record(name, seconds)
+
+
+class _Region:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def region(name):
+    """Context manager timing a block under name (no-op when disabled)."""
+    if not _patched:
+        return _null
+    return _Region(name)
+
+
+def _timed(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _bound_by_name(module, original):
+    # modules of this package holding original under the same name
+    here = os.path.dirname(os.path.abspath(__file__))
+    for other in list(sys.modules.values()):
+        path = getattr(other, '__file__', None)
+        if other is module or path is None or os.path.dirname(os.path.abspath(path)) != here:
+            continue
+        if getattr(other, original.__name__, None) is original:
+            yield other
+
+
+def enable():
+    import importlib
+    # import before taking the lock: importing EmulatorCore with
+    # EMULATOR_METRICS set calls enable() again
+    modules = {module_name: importlib.import_module(module_name) for module_name, _, _ in TARGETS}
+    with _lock:
+        if _patched:
+            return
+        for module_name, class_name, attr in TARGETS:
+            module = modules[module_name]
+            owner = module if class_name is None else getattr(module, class_name)
+            name = attr if class_name is None else f'{class_name}.{attr}'
+            # work on the raw class attribute to keep staticmethods static
+            original = owner.__dict__[attr]
+            if isinstance(original, staticmethod):
+                wrapped = staticmethod(_timed(name, original.__func__))
+            else:
+                wrapped = _timed(name, original)
+            setattr(owner, attr, wrapped)
+            _patched[(owner, attr)] = original
+            if class_name is None:
+                for other in _bound_by_name(module, original):
+                    setattr(other, attr, wrapped)
+                    _patched[(other, attr)] = original
+
+
+def disable():
+    with _lock:
+        for (owner, attr), original in _patched.items():
+            setattr(owner, attr, original)
+        _patched.clear()
+
+
+def reset():
+    _registry.reset()
+
+
+def snapshot():
+    """Call count, total/mean time and latency percentiles per name."""
+    return _registry.snapshot()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Inverse questions: which emission path keeps warming below a target.
+
+solve_emission finds, for every model at once, the largest (or smallest,
+if warming decreases with it) value of one Emission parameter for which
+Tatm stays at or below the target, the other parameters being fixed. It
+bisects all models (and all points of a frontier) together: each
+iteration is one paired EnsembleEmulator run with one candidate path per
+model, so a 1e-4 resolution on peak_emission costs ~17 runs of the
+vectorized emulator instead of a grid of Temp_CMIP reruns.
+
+    res = solve_emission(1.5, 'peak_emission', bounds=(0.5, 2.0),
+                         peak_year=2035, halve_year=2060, end_emission=0.1)
+    dict(zip(res['Model'], res['value']))
+
+emission_frontier repeats the search along a second parameter, e.g. the
+largest peak emission for every halve_year.
+"""
+
+import numpy as np
+
+from EmulatorCore import EnsembleEmulator, CMIP, model_parameters
+from UserEmission import DEFAULTS, EMISSION_PARAMETERS, START_YEAR, emission_matrix
+
+
+def _warming(values, fixed, shape, Model_params, metric, dt, Forcing_factor):
+    # one paired run: candidate k uses model k % n_models
+    params = dict(fixed)
+    params.update(values)
+    args = [np.broadcast_to(params[k], shape).ravel() for k in EMISSION_PARAMETERS]
+    _, emissions = emission_matrix(*args)
+    tatm, _ = EnsembleEmulator(emissions, dt=dt, Forcing_factor=Forcing_factor,
+                               Model_params=Model_params, paired=True).Run_sim()
+    if metric == 'max':
+        result = tatm.max(axis=0)
+    elif metric == 'end':
+        result = tatm[-1]
+    else:
+        raise ValueError(f"unknown metric '{metric}'")
+    return result.reshape(shape), emissions
+
+
+def _default_bounds(solve_for, fixed):
+    # the widest range that keeps start < peak < halve < end year, from
+    # the fixed values of the neighbouring parameters
+    if solve_for == 'peak_emission':
+        return 0., 3.
+    if solve_for == 'end_emission':
+        return 0., fixed['peak_emission']
+    if solve_for == 'peak_year':
+        return START_YEAR + 1, fixed['halve_year'] - 1
+    if solve_for == 'halve_year':
+        return fixed['peak_year'] + 1, fixed['end_year'] - 1
+    raise ValueError(f"bounds must be given when solving for '{solve_for}'")
+
+
+def solve_emission(target, solve_for = 'peak_emission', bounds = None, Model_names = None,
+                   metric = 'max', dt = 1, Forcing_factor = 1.1, tol = 1e-4, max_iter = 100,
+                   **fixed):
+    """Bound on one Emission parameter that keeps Tatm <= target, per model.
+
+    solve_for is one of EMISSION_PARAMETERS and is searched in bounds; the
+    others are taken from fixed (keyword arguments, defaulting to DEFAULTS)
+    and may be arrays, whose broadcast shape B is kept in the result.
+    bounds defaults to (0, 3) for peak_emission, (0, peak_emission) for
+    end_emission and, for peak_year and halve_year, to the years between
+    their fixed neighbours (e.g. START_YEAR+1..halve_year-1); it must be
+    given for end_year. Each bound may also be an array broadcasting to B.
+    metric 'max' limits the peak warming over the path, 'end' the warming
+    in its last year. Years are searched on whole years.
+
+    Warming is assumed monotonic in solve_for over bounds; its direction
+    is taken from the two bounds. Returns a dict with
+      'Model'         the model names,
+      'value'         B + (n_models,) limit value, nan if even the most
+                      favourable bound exceeds the target,
+      'unconstrained' True where the whole range meets the target (value
+                      is then the bound),
+      'warming'       the metric at value,
+      'budget'        cumulative emissions of that path (GtC),
+      'iterations'    number of bisection runs.
+    """
+    if solve_for not in EMISSION_PARAMETERS:
+        raise KeyError(f"unknown emission parameter '{solve_for}'")
+    if solve_for in fixed:
+        raise TypeError(f"'{solve_for}' is solved for and cannot be fixed")
+    unknown = set(fixed) - set(EMISSION_PARAMETERS)
+    if unknown:
+        raise TypeError(f'unknown emission parameters {sorted(unknown)}')
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    Model_names = list(Model_names)
+    fixed = {k: np.asarray(fixed.get(k, DEFAULTS[k]), dtype=float)
+             for k in EMISSION_PARAMETERS if k != solve_for}
+    shape = np.broadcast_shapes(*(v.shape for v in fixed.values())) + (len(Model_names),)
+    # align the fixed parameters with the leading axes, before the models
+    fixed = {k: v[..., None] for k, v in fixed.items()}
+    n_points = int(np.prod(shape[:-1]))
+    Model_params = {k: np.tile(v, n_points) for k, v in model_parameters(Model_names).items()}
+    integer = solve_for.endswith('_year')
+
+    def warming(x):
+        return _warming({solve_for: x}, fixed, shape, Model_params, metric, dt, Forcing_factor)
+
+    if bounds is None:
+        bounds = _default_bounds(solve_for, fixed)
+    lo, hi = (np.array(np.broadcast_to(np.asarray(bound, dtype=float), shape)) for bound in bounds)
+    w_lo, _ = warming(lo)
+    w_hi, _ = warming(hi)
+    iterations = 2
+    increasing = w_hi >= w_lo
+    # a: the end of the range that is most likely to meet the target
+    a = np.where(increasing, lo, hi)
+    b = np.where(increasing, hi, lo)
+    w_a = np.where(increasing, w_lo, w_hi)
+    w_b = np.where(increasing, w_hi, w_lo)
+    infeasible = w_a > target
+    unconstrained = ~infeasible & (w_b <= target)
+    active = ~infeasible & ~unconstrained
+    step = 1 if integer else tol
+    while np.any(active & (np.abs(b - a) > step)) and iterations < max_iter:
+        mid = (a + b)/2
+        if integer:
+            # stay on whole years, strictly between a and b
+            mid = np.where(b > a, np.floor(mid), np.ceil(mid))
+        w_mid, _ = warming(mid)
+        iterations += 1
+        ok = w_mid <= target
+        a = np.where(active & ok, mid, a)
+        b = np.where(active & ~ok, mid, b)
+
+    value = np.where(unconstrained, b, a)
+    value = np.where(infeasible, np.nan, value)
+    w_value, emissions = warming(np.where(infeasible, a, value))
+    emissions = emissions.reshape(shape + (emissions.shape[-1],))
+    budget = emissions.sum(axis=-1)*dt
+    return {'Model': Model_names,
+            'value': value,
+            'unconstrained': unconstrained,
+            'warming': np.where(infeasible, np.nan, w_value),
+            'budget': np.where(infeasible, np.nan, budget),
+            'iterations': iterations}
+
+
+def emission_frontier(target, solve_for, over, values, **kwargs):
+    """solve_emission for every value of the parameter over.
+
+    Returns the solve_emission dict with a leading axis of len(values) and
+    the swept values under 'over' (values may also be an array of any
+    shape, which then leads).
+    """
+    values = np.asarray(values, dtype=float)
+    kwargs[over] = values
+    result = solve_emission(target, solve_for, **kwargs)
+    result['over'] = values
+    return result
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for the linear recurrences x_{t+1} = A x_t + g u_t used by the
+carbon cycle and the two-box temperature model.
+
+A whole trajectory is x_t = A^t x_0 + sum_{s<t} A^(t-1-s) g u_s, so it can be
+computed from the stacked powers of A and one causal convolution of the
+input with the impulse response K[k] = A^k g.
+"""
+
+import numpy as np
+
+# above this many steps the convolution is done with an FFT instead of a
+# dense lower triangular (Toeplitz) product
+FFT_THRESHOLD = 512
+
+
+def matrix_powers(A, num_periods):
+    """Return P with P[k] = A^k for k = 0..num_periods, shape (n+1, k, k)."""
+    A = np.asarray(A, dtype=float)
+    P = np.empty((num_periods + 1,) + A.shape)
+    P[0] = np.eye(A.shape[0])
+    for k in range(1, num_periods + 1):
+        P[k] = A @ P[k - 1]
+    return P
+
+
+def impulse_response(powers, g):
+    """Return K with K[k] = A^k g, shape (n, k), from matrix_powers output."""
+    return powers[:-1] @ np.asarray(g, dtype=float)
+
+
+def free_response(powers, x0):
+    """Return A^t x0 for t = 0..n with shape (..., n+1, k).
+
+    x0 has shape (..., k).
+    """
+    return np.einsum('tij,...j->...ti', powers, np.asarray(x0, dtype=float))
+
+
+def causal_convolve(kernel, signal, fft_threshold = FFT_THRESHOLD):
+    """Forced response out[..., t, i] = sum_{s<t} kernel[t-1-s, i]*signal[..., s].
+
+    kernel has shape (n, k), signal (..., n); the result has shape
+    (..., n+1, k) and out[..., 0, :] is zero.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    num_periods = signal.shape[-1]
+    kernel = kernel[:num_periods]
+    out = np.zeros(signal.shape[:-1] + (num_periods + 1, kernel.shape[1]))
+    if num_periods == 0:
+        return out
+    if num_periods <= fft_threshold:
+        # T[i, t, s] = kernel[t-s, i] for s <= t
+        lag = np.arange(num_periods)[:, None] - np.arange(num_periods)[None, :]
+        T = np.where(lag[None] >= 0, kernel.T[:, np.clip(lag, 0, None)], 0.0)
+        out[..., 1:, :] = np.einsum('its,...s->...ti', T, signal)
+    else:
+        n_fft = 2*num_periods
+        K = np.fft.rfft(kernel, n=n_fft, axis=0)
+        U = np.fft.rfft(signal, n=n_fft, axis=-1)
+        y = np.fft.irfft(U[..., :, None]*K, n=n_fft, axis=-2)
+        out[..., 1:, :] = y[..., :num_periods, :]
+    return out
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo runs over the uncertainty of the CMIP temperature parameters.
+
+ParameterSampler draws parameter sets around the CMIP ensemble, either from
+a multivariate log-normal fitted to the table rows (keeps the correlation
+between c1, c3, c4, lambda and F2xco2, and every draw positive) or by
+resampling the rows. Run_montecarlo runs the draws in chunks through the
+vectorized EnsembleEmulator and only keeps a QuantileSketch per variable,
+so memory does not grow with the number of draws:
+
+    summary = Run_montecarlo(emission, n_draws=100000, seed=1)
+    summary['Tatm']['quantiles']    # (5, n_years) 5/17/50/83/95% bands
+"""
+
+import numpy as np
+
+from EmulatorCore import CMIP, EnsembleEmulator, TEMP_PARAMETERS, model_parameters
+from Results import simulation_years
+from TempModule import spectral_radius
+
+# rows of the CMIP table that are not CMIP models: the multi-model means,
+# which would pull the fit and the resampling towards the mean, and the
+# DICE2016 calibration (an outlier, stable up to 36-year steps)
+NOT_SAMPLED = ('MMM_CMIP5', 'MMM_CMIP6', 'DICE2016')
+# parameters drawn by the log-normal fit; ECS follows as F2xco2/lambda
+SAMPLED = ('c1', 'c3', 'c4', 'lambda', 'F2xco2')
+QUANTILES = (0.05, 0.17, 0.5, 0.83, 0.95)
+# variables that depend on the temperature parameters (the carbon cycle
+# uses the same 'MMM' parameters for every draw)
+VARIABLES = ('Tatm', 'Tocean', 'Forcing')
+
+
+class ParameterSampler:
+    """Draws TEMP_PARAMETERS sets around a set of CMIP models.
+
+    method = 'lognormal' fits a multivariate normal to the logarithm of the
+    SAMPLED columns over the models; the initial temperatures are taken from
+    randomly chosen models. method = 'resample' draws whole model rows.
+    Draws whose time stepping would be unstable for the given dt are
+    redrawn. The default models are the CMIP models only, without the rows
+    in NOT_SAMPLED (the multi-model means and DICE2016).
+    """
+    def __init__(self, Model_names = None, method = 'lognormal', seed = None, Model_params = None):
+        if method not in ('lognormal', 'resample'):
+            raise ValueError(f"unknown sampling method '{method}'")
+        if Model_params is None:
+            if Model_names is None:
+                Model_names = [name for name in CMIP.index if name not in NOT_SAMPLED]
+            Model_params = model_parameters(Model_names)
+        self.params = {k: np.asarray(Model_params[k], dtype=float) for k in TEMP_PARAMETERS}
+        self.method = method
+        self.rng = np.random.default_rng(seed)
+        if method == 'lognormal':
+            logs = np.log(np.stack([self.params[k] for k in SAMPLED], axis=1))
+            self.mean = logs.mean(axis=0)
+            self.cov = np.cov(logs, rowvar=False)
+
+    def draw(self, n):
+        """n parameter sets as a dict of (n,) arrays, without the stability check."""
+        n_models = len(self.params['c1'])
+        rows = self.rng.integers(n_models, size=n)
+        if self.method == 'resample':
+            return {k: v[rows] for k, v in self.params.items()}
+        values = np.exp(self.rng.multivariate_normal(self.mean, self.cov, size=n))
+        draws = {k: values[:, j] for j, k in enumerate(SAMPLED)}
+        draws['ECS'] = draws['F2xco2']/draws['lambda']
+        draws['Tatm0'] = self.params['Tatm0'][rows]
+        draws['Tocean0'] = self.params['Tocean0'][rows]
+        return draws
+
+    def sample(self, n, dt = 1):
+        """n stable parameter sets for time step dt as a dict of (n,) arrays."""
+        chunks = []
+        needed = n
+        for _ in range(100):
+            draws = self.draw(max(needed, 16))
+            stable = spectral_radius(draws['c1'], draws['c3'], draws['c4'], draws['lambda'], dt) < 1
+            draws = {k: v[stable][:needed] for k, v in draws.items()}
+            chunks.append(draws)
+            needed -= len(draws['c1'])
+            if needed <= 0:
+                return {k: np.concatenate([c[k] for c in chunks]) for k in TEMP_PARAMETERS}
+        raise RuntimeError(f'could not draw stable parameters for dt = {dt}')
+
+
+class QuantileSketch:
+    """Streaming per-year distribution of many trajectories.
+
+    Values are counted in bins of width resolution (the bin range grows as
+    needed), so quantiles are accurate to within one bin width while memory
+    only depends on the value range; count, mean, min and max are exact.
+    Sketches of the same shape can be merged.
+    """
+    def __init__(self, n_years, resolution = 1e-3):
+        self.n_years = n_years
+        self.resolution = resolution
+        self.origin = 0
+        self.counts = np.zeros((n_years, 0), dtype=np.int64)
+        self.count = 0
+        self.total = np.zeros(n_years)
+        self.min = np.full(n_years, np.inf)
+        self.max = np.full(n_years, -np.inf)
+
+    def _grow(self, lo, hi):
+        # make bins lo..hi (absolute bin numbers) available
+        n_bins = self.counts.shape[1]
+        if n_bins == 0:
+            self.origin = lo
+            self.counts = np.zeros((self.n_years, hi - lo + 1), dtype=np.int64)
+            return
+        new_lo = min(lo, self.origin)
+        new_hi = max(hi, self.origin + n_bins - 1)
+        if new_lo == self.origin and new_hi == self.origin + n_bins - 1:
+            return
+        counts = np.zeros((self.n_years, new_hi - new_lo + 1), dtype=np.int64)
+        counts[:, self.origin - new_lo:self.origin - new_lo + n_bins] = self.counts
+        self.origin = new_lo
+        self.counts = counts
+
+    def update(self, values):
+        """Add trajectories given as an (n, n_years) array."""
+        values = np.asarray(values, dtype=float).reshape(-1, self.n_years)
+        if values.shape[0] == 0:
+            return
+        if not np.all(np.isfinite(values)):
+            raise ValueError('trajectories must be finite')
+        bins = np.floor(values/self.resolution).astype(np.int64)
+        self._grow(int(bins.min()), int(bins.max()))
+        n_bins = self.counts.shape[1]
+        flat = (bins - self.origin) + np.arange(self.n_years)*n_bins
+        self.counts += np.bincount(flat.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        self.count += values.shape[0]
+        self.total += values.sum(axis=0)
+        self.min = np.minimum(self.min, values.min(axis=0))
+        self.max = np.maximum(self.max, values.max(axis=0))
+
+    def merge(self, other):
+        if other.n_years != self.n_years or other.resolution != self.resolution:
+            raise ValueError('sketches must have the same years and resolution')
+        if other.count == 0:
+            return
+        self._grow(other.origin, other.origin + other.counts.shape[1] - 1)
+        start = other.origin - self.origin
+        self.counts[:, start:start + other.counts.shape[1]] += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    def mean(self):
+        return self.total/self.count
+
+    def quantile(self, q):
+        """Quantiles q (scalar or sequence) per year, shape (len(q), n_years)."""
+        if self.count == 0:
+            raise ValueError('empty sketch')
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        cum = np.cumsum(self.counts, axis=1)
+        out = np.empty((len(q), self.n_years))
+        for i, qi in enumerate(q):
+            rank = qi*self.count
+            # first bin whose cumulative count reaches the rank, then linear
+            # interpolation inside that bin
+            b = np.minimum((cum < rank).sum(axis=1), self.counts.shape[1] - 1)
+            years = np.arange(self.n_years)
+            before = np.where(b > 0, cum[years, b - 1], 0)
+            inside = self.counts[years, b]
+            frac = np.clip((rank - before)/np.maximum(inside, 1), 0, 1)
+            out[i] = (self.origin + b + frac)*self.resolution
+        return np.clip(out, self.min, self.max)
+
+    def summary(self, quantiles = QUANTILES):
+        return {'quantiles': self.quantile(quantiles),
+                'mean': self.mean(),
+                'min': self.min.copy(),
+                'max': self.max.copy(),
+                'count': self.count}
+
+
+def Run_montecarlo(emission, n_draws = 10000, Model_names = None, method = 'lognormal',
+                   dt = 1, Forcing_factor = 1.1, quantiles = QUANTILES, variables = ('Tatm',),
+                   chunk_size = 4096, seed = None, resolution = 1e-3, sketches = None,
+                   progress = None):
+    """Run n_draws sampled parameter sets on one emission path.
+
+    Returns a dict with 'Year', 'quantiles' and, per requested variable
+    (from VARIABLES), the QuantileSketch.summary: a (len(quantiles),
+    n_years) 'quantiles' band plus exact 'mean', 'min', 'max' and 'count'.
+    The draws are simulated chunk_size at a time and only the sketches are
+    kept. Passing the 'sketches' dict of an earlier result adds the new
+    draws to it (e.g. to refine a summary later); the seed is then combined
+    with the number of draws already in the sketches, so the same seed does
+    not replay the earlier draws. progress, if given, is called with the
+    number of draws done so far.
+    """
+    emission = np.asarray(emission, dtype=float)
+    if emission.ndim != 1:
+        raise ValueError('Run_montecarlo takes a single emission path')
+    for name in variables:
+        if name not in VARIABLES:
+            raise KeyError(f"unknown Monte Carlo variable '{name}'")
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be a positive integer')
+    num_periods = len(emission)
+    if sketches is None:
+        sketches = {}
+    previous = max((sketch.count for sketch in sketches.values()), default=0)
+    if seed is not None and previous:
+        seed = np.random.SeedSequence(seed, spawn_key=(previous,))
+    sampler = ParameterSampler(Model_names, method, seed)
+    for name in variables:
+        if name not in sketches:
+            n_years = num_periods if name == 'Forcing' else num_periods + 1
+            sketches[name] = QuantileSketch(n_years, resolution)
+
+    done = 0
+    while done < n_draws:
+        n = min(chunk_size, n_draws - done)
+        ensemble = EnsembleEmulator(emission, dt=dt, Forcing_factor=Forcing_factor,
+                                    Model_params=sampler.sample(n, dt))
+        ensemble.Run_sim()
+        results = ensemble.getFinal()
+        for name in variables:
+            sketches[name].update(results[name])
+        done += n
+        if progress is not None:
+            progress(done)
+
+    out = {'Year': simulation_years(num_periods, dt),
+           'quantiles': np.asarray(quantiles, dtype=float),
+           'sketches': sketches}
+    for name in variables:
+        out[name] = sketches[name].summary(quantiles)
+    return out
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process batch runner for large scenario x model sweeps.
+
+Scenarios are sharded across a ProcessPoolExecutor. The emission matrix
+and the model parameters live in multiprocessing.shared_memory blocks, so
+workers only receive block names and row ranges. Each worker writes its
+chunk into one of a few shared output slots instead of sending arrays
+back through pickling, and the parent copies the slot once into the
+preallocated result, so the output is held once plus one slot per task
+in flight.
+
+    from ParallelRunner import Run_parallel
+    out = Run_parallel(emissions, workers=8, chunk_size=256)
+    out['Tatm'].shape   # (n_scenarios, n_models, n_periods+1)
+
+A pool passed as executor is reused across calls instead of starting a
+new one per call; its number of processes must then be given as workers:
+
+    with ProcessPoolExecutor(8) as pool:
+        for block in blocks:
+            out = Run_parallel(block, workers=8, executor=pool)
+
+With archive = RunArchive.create(...) the workers write into the
+archive's memory-mapped files instead, so the output does not need to
+fit in memory, and scenarios already done in the archive are skipped.
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from EmulatorCore import EnsembleEmulator, SWEEP_VARIABLES, TEMP_PARAMETERS, model_parameters
+
+
+def _output_shape(name, n_scenarios, n_models, num_periods):
+    n_years = num_periods if name == 'Forcing' else num_periods + 1
+    n_cols = 1 if name.startswith('M_') else n_models
+    return (n_scenarios, n_cols, n_years)
+
+
+class _SharedArray:
+    """A float64 array in a named shared memory block."""
+    def __init__(self, shape, name = None):
+        self.shape = tuple(shape)
+        size = max(int(np.prod(self.shape)) * 8, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # attached blocks belong to the parent, which unlinks them;
+            # workers share its resource tracker, so there is nothing to
+            # unregister here
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=float, buffer=self.shm.buf)
+
+    @property
+    def spec(self):
+        return ('shm', self.shm.name, self.shape)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class _MappedArray:
+    """A variable of a RunArchive, opened through np.memmap."""
+    def __init__(self, path):
+        self.path = str(path)
+        self.array = np.load(self.path, mmap_mode='r+')
+
+    @property
+    def spec(self):
+        return ('npy', self.path)
+
+    def close(self):
+        self.array.flush()
+        self.array = None
+
+
+def _attach(spec):
+    if spec[0] == 'npy':
+        return _MappedArray(spec[1])
+    return _SharedArray(spec[2], spec[1])
+
+
+def _simulate(start, stop, emissions, params, outputs, dt, Forcing_factor, offset = 0):
+    # rows start:stop go to rows start-offset:stop-offset of the outputs
+    Model_params = dict(zip(TEMP_PARAMETERS, params))
+    ensemble = EnsembleEmulator(emissions[start:stop], dt=dt,
+                                Forcing_factor=Forcing_factor, Model_params=Model_params)
+    ensemble.Run_sim()
+    results = ensemble.getFinal()
+    for name, out in outputs.items():
+        out[start - offset:stop - offset] = results[name]
+    return stop - start
+
+
+def _run_chunk(task):
+    # executed in the worker processes; slot is None for archive files,
+    # which are written at the scenario rows
+    start, stop, emission_spec, param_spec, output_specs, slot, dt, Forcing_factor = task
+    emissions = _attach(emission_spec)
+    params = _attach(param_spec)
+    outputs = {name: _attach(spec) for name, spec in output_specs.items()}
+    try:
+        if slot is None:
+            arrays, offset = {name: out.array for name, out in outputs.items()}, 0
+        else:
+            arrays, offset = {name: out.array[slot] for name, out in outputs.items()}, start
+        return _simulate(start, stop, emissions.array, params.array, arrays, dt, Forcing_factor, offset)
+    finally:
+        for block in [emissions, params] + list(outputs.values()):
+            block.close()
+
+
+def Run_parallel(emissions, Model_names = None, dt = 1, Forcing_factor = 1.1,
+                 variables = ('Tatm',), workers = None, chunk_size = 256,
+                 Model_params = None, progress = None, archive = None, executor = None):
+    """Run a (n_scenarios, n_periods) emission matrix over many processes.
+
+    Returns a dict of (scenario, model, year) arrays like Run_sweep, for the
+    requested variables only (carbon reservoirs have a model axis of 1).
+    Model_params may give perturbed TEMP_PARAMETERS arrays instead of CMIP
+    model names. workers defaults to os.cpu_count(); progress, if given,
+    is called with the number of scenarios finished so far. executor, a
+    ProcessPoolExecutor owned by the caller, is used instead of a new pool
+    and left running; workers is then required and gives its number of
+    processes, which sets how many chunks are queued.
+
+    archive, a writable RunArchive.RunArchive for these emissions, makes
+    the workers write its variables straight into its files; chunks whose
+    scenarios are all done already are skipped, each finished chunk is
+    marked done, and the archive is returned instead of a dict.
+    """
+    emissions = np.atleast_2d(np.asarray(emissions, dtype=float))
+    n_scenarios, num_periods = emissions.shape
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be a positive integer')
+    if Model_params is None:
+        Model_params = model_parameters(Model_names)
+    param_block = np.stack([np.asarray(Model_params[k], dtype=float) for k in TEMP_PARAMETERS])
+    n_models = param_block.shape[1]
+    for name in variables:
+        if name not in SWEEP_VARIABLES:
+            raise KeyError(f"unknown sweep variable '{name}'")
+    if archive is not None:
+        if archive.shape('Tatm')[:2] != (n_scenarios, n_models) or archive.num_periods != num_periods:
+            raise ValueError('the archive was created for other emissions or models')
+        variables = archive.variables
+        dt = archive.dt
+        Forcing_factor = archive.Forcing_factor
+    if workers is None:
+        if executor is not None:
+            raise ValueError('workers must be given with executor, as its number of processes')
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError('workers must be a positive integer')
+    inline = workers == 1 and executor is None
+    # chunks queued at once, each with its own output slot
+    n_slots = min(2*workers, -(-n_scenarios//chunk_size))
+
+    shared = []
+    try:
+        results = {}
+        outputs = {}
+        if archive is None:
+            for name in variables:
+                results[name] = np.empty(_output_shape(name, n_scenarios, n_models, num_periods))
+                if not inline:
+                    outputs[name] = _SharedArray((n_slots,) + _output_shape(name, chunk_size, n_models,
+                                                                            num_periods))
+                    shared.append(outputs[name])
+        else:
+            for name in variables:
+                outputs[name] = _MappedArray(archive.filename(name))
+                shared.append(outputs[name])
+        if inline:
+            arrays = results if archive is None else {name: out.array for name, out in outputs.items()}
+            emission_shm = param_shm = None
+        else:
+            emission_shm = _SharedArray(emissions.shape)
+            shared.append(emission_shm)
+            emission_shm.array[:] = emissions
+            param_shm = _SharedArray(param_block.shape)
+            shared.append(param_shm)
+            param_shm.array[:] = param_block
+        output_specs = {name: out.spec for name, out in outputs.items()}
+        starts = range(0, n_scenarios, chunk_size)
+        done = 0
+        if archive is not None:
+            finished = np.asarray(archive.done)
+            done = int(finished.sum())
+            starts = [start for start in starts if not finished[start:start + chunk_size].all()]
+            done -= sum(int(finished[start:start + chunk_size].sum()) for start in starts)
+        ranges = [(start, min(start + chunk_size, n_scenarios)) for start in starts]
+
+        def chunk_done(start, stop, finished):
+            nonlocal done
+            done += finished
+            if archive is not None:
+                for out in outputs.values():
+                    out.array.flush()
+                archive.mark_done(start, stop)
+            if progress is not None:
+                progress(done)
+
+        if inline:
+            for start, stop in ranges:
+                chunk_done(start, stop, _simulate(start, stop, emissions, param_block,
+                                                  arrays, dt, Forcing_factor))
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers) if executor is None else executor
+            try:
+                _run_tasks(pool, ranges, n_slots, emission_shm.spec, param_shm.spec, output_specs,
+                           dt, Forcing_factor, archive is None, outputs, results, chunk_done)
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        if archive is not None:
+            return archive
+        return results
+    finally:
+        for block in shared:
+            block.close()
+
+
+def _run_tasks(pool, ranges, n_slots, emission_spec, param_spec, output_specs, dt, Forcing_factor,
+               slotted, outputs, results, chunk_done):
+    # keep at most n_slots chunks queued; a finished chunk frees its slot
+    # once it has been copied into results
+    ranges = iter(ranges)
+    free = list(range(n_slots))
+    running = {}
+    try:
+        while True:
+            while free:
+                chunk = next(ranges, None)
+                if chunk is None:
+                    break
+                slot = free.pop()
+                task = (chunk[0], chunk[1], emission_spec, param_spec, output_specs,
+                        slot if slotted else None, dt, Forcing_factor)
+                running[pool.submit(_run_chunk, task)] = (chunk, slot)
+            if not running:
+                return
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                (start, stop), slot = running.pop(future)
+                count = future.result()
+                if slotted:
+                    for name, out in outputs.items():
+                        results[name][start:stop] = out.array[slot, :stop - start]
+                free.append(slot)
+                chunk_done(start, stop, count)
+    except BaseException:
+        # the shared blocks are released by the caller, so let no task
+        # outlive them
+        for future in running:
+            future.cancel()
+        wait(running)
+        raise
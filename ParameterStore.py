@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled cache of the model parameter tables in data/CMIPparas.xlsx.
+
+Parsing the spreadsheet needs pandas/openpyxl and is slow, so the sheets
+are converted once into a .npz file next to it and reloaded from there.
+The cache records the size, mtime and sha256 of the spreadsheet and is
+rebuilt automatically when the spreadsheet changes. Nothing is read until
+a table is first accessed.
+
+Tables expose their numeric columns as one contiguous float64 array:
+
+    CMIP = table('CMIP')
+    CMIP.loc['MIROC6']['c1']            # float
+    CMIP.loc[['MIROC6', 'CanESM2']]['c1']  # (2,) array
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+DATA_FILENAME_CMIP = Path(__file__).parent/'data/CMIPparas.xlsx'
+CACHE_FILENAME_CMIP = Path(__file__).parent/'data/CMIPparas.cache.npz'
+SHEETS = ('CMIP', 'CMIP5', 'CMIP6', 'carbon')
+
+# bump when the layout of the cache file changes
+CACHE_VERSION = 1
+
+
+class ParameterRow:
+    """Read-only column access to one row (or a block of rows) of a table."""
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __getitem__(self, column):
+        data = self.table.data()
+        if column in data['column_index']:
+            return data['values'][self.rows, data['column_index'][column]]
+        if column in data['labels']:
+            return data['labels'][column][self.rows]
+        raise KeyError(column)
+
+    def get(self, column, default = None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def keys(self):
+        data = self.table.data()
+        return list(data['columns']) + list(data['labels'])
+
+    @property
+    def key(self):
+        # identifies the row(s) until the store is reloaded
+        rows = self.rows if np.ndim(self.rows) == 0 else tuple(np.ravel(self.rows).tolist())
+        store = self.table.store
+        return (id(store), store.generation, self.table.sheet, rows)
+
+
+class _Loc:
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, name):
+        row_index = self.table.data()['row_index']
+        if isinstance(name, str):
+            try:
+                return ParameterRow(self.table, row_index[name])
+            except KeyError:
+                raise KeyError(name) from None
+        rows = np.array([row_index[n] for n in name], dtype=np.intp)
+        return ParameterRow(self.table, rows)
+
+
+class ParameterTable:
+    """One sheet of the parameter spreadsheet, indexed by 'Model'."""
+    def __init__(self, store, sheet):
+        self.store = store
+        self.sheet = sheet
+        self.loc = _Loc(self)
+
+    def data(self):
+        return self.store.load()[self.sheet]
+
+    @property
+    def index(self):
+        return self.data()['index']
+
+    @property
+    def columns(self):
+        return self.data()['columns']
+
+    @property
+    def values(self):
+        return self.data()['values']
+
+    def column(self, name):
+        data = self.data()
+        return data['values'][:, data['column_index'][name]]
+
+    def to_frame(self):
+        import pandas as pd
+        data = self.data()
+        df = pd.DataFrame(data['values'], columns=list(data['columns']),
+                          index=pd.Index(data['index'], name='Model'))
+        for name, labels in data['labels'].items():
+            df[name] = labels
+        return df
+
+
+class ParameterStore:
+    def __init__(self, source = DATA_FILENAME_CMIP, cache = CACHE_FILENAME_CMIP):
+        self.source = Path(source)
+        self.cache = Path(cache)
+        self._tables = None
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def table(self, sheet):
+        return ParameterTable(self, sheet)
+
+    def load(self):
+        if self._tables is None:
+            with self._lock:
+                if self._tables is None:
+                    self._tables = self._load()
+        return self._tables
+
+    def reload(self):
+        with self._lock:
+            self._tables = None
+            self.generation += 1
+        return self.load()
+
+    def _stamp(self):
+        stat = os.stat(self.source)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _sha256(self):
+        with open(self.source, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _load(self):
+        stamp = self._stamp()
+        arrays = None
+        if self.cache.exists():
+            try:
+                with np.load(self.cache, allow_pickle=False) as npz:
+                    arrays = dict(npz)
+            except (OSError, ValueError):
+                arrays = None
+        if arrays is not None:
+            if int(arrays['version']) != CACHE_VERSION:
+                arrays = None
+            elif not np.array_equal(arrays['stamp'], stamp):
+                # mtime changes on checkout; only rebuild if the content did
+                sha = self._sha256()
+                if str(arrays['sha256']) != sha:
+                    arrays = None
+                else:
+                    arrays['stamp'] = stamp
+                    self._write(arrays)
+        if arrays is None:
+            arrays = self._compile()
+            arrays.update(version=np.array(CACHE_VERSION), stamp=stamp,
+                          sha256=np.array(self._sha256()))
+            self._write(arrays)
+        return {sheet: _unpack(arrays, sheet) for sheet in SHEETS}
+
+    def _compile(self):
+        import pandas as pd
+        arrays = {}
+        # one pass over the workbook for all sheets
+        sheets = pd.read_excel(self.source, sheet_name = list(SHEETS))
+        for sheet in SHEETS:
+            df = sheets[sheet].set_index('Model')
+            numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+            labels = [c for c in df.columns if c not in numeric]
+            arrays[f'{sheet}/index'] = np.array(df.index.astype(str).tolist())
+            arrays[f'{sheet}/columns'] = np.array([str(c) for c in numeric])
+            arrays[f'{sheet}/values'] = np.ascontiguousarray(df[numeric].to_numpy(dtype=float))
+            arrays[f'{sheet}/label_names'] = np.array([str(c) for c in labels])
+            for c in labels:
+                arrays[f'{sheet}/label/{c}'] = np.array(df[c].astype(str).tolist())
+        return arrays
+
+    def _write(self, arrays):
+        # the cache is only an optimisation, e.g. the data folder may be read-only
+        tmp = self.cache.with_name(self.cache.name + f'.{os.getpid()}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self.cache)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def _unpack(arrays, sheet):
+    index = arrays[f'{sheet}/index']
+    columns = tuple(arrays[f'{sheet}/columns'].tolist())
+    values = np.ascontiguousarray(arrays[f'{sheet}/values'], dtype=float)
+    values.setflags(write=False)
+    labels = {name: arrays[f'{sheet}/label/{name}']
+              for name in arrays[f'{sheet}/label_names'].tolist()}
+    return {'index': index,
+            'columns': columns,
+            'values': values,
+            'labels': labels,
+            'row_index': {name: i for i, name in enumerate(index.tolist())},
+            'column_index': {name: i for i, name in enumerate(columns)}}
+
+
+store = ParameterStore()
+
+
+def table(sheet):
+    return store.table(sheet)
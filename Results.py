@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar container for per-model time series.
+
+A ResultTable holds one variable (e.g. Tatm) for several models in one
+contiguous (n_years, n_models) float64 array, time first as returned by
+Run_sim and Temp_ensemble, with its year axis and model index. Columns,
+year windows and the pandas frame are views of that array, so handing a
+run to the dashboard or a batch job does not copy it:
+
+    res = Emulator.CMIP_results(emission)
+    res['MIROC6']                  # (n_years,) view
+    res.to_frame()                 # DataFrame sharing res.values
+    res.to_parquet('tatm.parquet')
+"""
+
+import numpy as np
+
+
+def simulation_years(num_periods, dt = 1, start_year = 2020):
+    """Years of the num_periods+1 states of a run (integers when dt is)."""
+    years = start_year + np.arange(num_periods + 1)*dt
+    if float(dt).is_integer() and float(start_year).is_integer():
+        years = years.astype(np.int64)
+    return years
+
+
+class ResultTable:
+    def __init__(self, values, years, Model_names, variable = 'Tatm'):
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        if not values.flags.c_contiguous:
+            values = np.ascontiguousarray(values)
+        self.values = values
+        self.years = np.asarray(years)
+        self.Model_names = tuple(Model_names)
+        self.variable = variable
+        if values.shape != (len(self.years), len(self.Model_names)):
+            raise ValueError(f'values of shape {values.shape} do not match '
+                             f'{len(self.years)} years and {len(self.Model_names)} models')
+        self._index = {name: j for j, name in enumerate(self.Model_names)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __len__(self):
+        return len(self.years)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        try:
+            return self.values[:, self._index[name]]
+        except KeyError:
+            raise KeyError(name) from None
+
+    def __array__(self, dtype = None, copy = None):
+        if dtype is None or np.dtype(dtype) == self.values.dtype:
+            return self.values.copy() if copy else self.values
+        return self.values.astype(dtype)
+
+    def select(self, Model_names):
+        """New table with the given models only (a copy)."""
+        columns = [self._index[name] for name in Model_names]
+        return ResultTable(self.values[:, columns], self.years, Model_names, self.variable)
+
+    def window(self, start_year = None, end_year = None):
+        """Table of the years start_year..end_year (inclusive), as a view."""
+        lo = 0 if start_year is None else int(np.searchsorted(self.years, start_year, side='left'))
+        hi = len(self.years) if end_year is None else int(np.searchsorted(self.years, end_year, side='right'))
+        return ResultTable(self.values[lo:hi], self.years[lo:hi], self.Model_names, self.variable)
+
+    def to_frame(self, year_column = 'Year'):
+        """DataFrame with one column per model (sharing values) and a year column."""
+        import pandas as pd
+        df = pd.DataFrame(self.values, columns=pd.Index(self.Model_names, name='Model'), copy=False)
+        if year_column is not None:
+            df[year_column] = self.years
+        return df
+
+    def to_arrow(self, year_column = 'Year'):
+        """pyarrow Table with a year column and one column per model."""
+        import pyarrow as pa
+        columns = [pa.array(self.values[:, j]) for j in range(len(self.Model_names))]
+        names = list(self.Model_names)
+        if year_column is not None:
+            columns.insert(0, pa.array(self.years))
+            names.insert(0, year_column)
+        return pa.Table.from_arrays(columns, names=names,
+                                    metadata={b'variable': self.variable.encode()})
+
+    def to_parquet(self, path, year_column = 'Year', **kwargs):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(year_column), path, **kwargs)
+
+    @classmethod
+    def from_arrow(cls, table, year_column = 'Year'):
+        names = [name for name in table.column_names if name != year_column]
+        values = np.empty((table.num_rows, len(names)))
+        for j, name in enumerate(names):
+            values[:, j] = table.column(name).to_numpy()
+        metadata = table.schema.metadata or {}
+        variable = metadata.get(b'variable', b'Tatm').decode()
+        return cls(values, table.column(year_column).to_numpy(), names, variable)
+
+    @classmethod
+    def read_parquet(cls, path, year_column = 'Year'):
+        import pyarrow.parquet as pq
+        return cls.from_arrow(pq.read_table(path), year_column)
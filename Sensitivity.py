@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Sensitivities of Tatm to the emissions and the model parameters.
+
+The carbon cycle is linear in the emissions and the temperature boxes are
+linear in the forcing, so the only non-linear link is the logarithmic
+forcing. For the last run of a DICETemp/CarbonCycle pair
+
+    dTatm[t]/de[s] = sum_k  KT[t-1-k] * dF[k]/dM_at[k] * KC[k-1-s]*dt
+
+with KC and KT the impulse responses of the carbon and temperature updates
+(see the propagator methods) and dF/dM_at = F2xco2*Forc_fac/(M_at*log 2)
+taken at the run's M_at. Parameter sensitivities are propagated forward
+through the same time steps as Run_sim. Use through Emulator.Jacobian or
+EnsembleEmulator.Jacobian after Run_sim:
+
+    em = Emulator(emission, 'MIROC6'); tatm, _ = em.Run_sim()
+    jac = em.Jacobian()
+    tatm_new = linear_update(tatm, jac, emission=new_emission - emission)
+"""
+
+import numpy as np
+
+from TempModule import step_matrix
+
+# parameters with a sensitivity; ECS is not used by the time stepping
+PARAMETERS = ('c1', 'c3', 'c4', 'lambda', 'F2xco2', 'Tatm0', 'Tocean0')
+
+
+def jacobian(TempClass, CarbonClass, parameters = PARAMETERS, run_sim_order = True):
+    """Jacobian of Tatm of the last run of a DICETemp/CarbonCycle pair.
+
+    Returns a dict with 'emission', of shape (n+1, *batch, n), holding
+    dTatm[t]/de[s] for the n per-year emission rates (as passed to Run_sim,
+    i.e. before multiplying by dt), and one (n+1, *batch) array per name in
+    parameters with dTatm[t]/dparameter. batch is the shape of the
+    temperature states (e.g. (n_models,) for an ensemble). The emission
+    Jacobian takes O(batch * n^2) memory, so it is meant for single
+    scenarios rather than large sweeps. run_sim_order must match the ocean
+    update of the run (see EnsembleEmulator).
+    """
+    tatm, tocean, forcing = TempClass.getFinal()
+    tatm = np.asarray(tatm['Tatm'], dtype=float)
+    tocean = np.asarray(tocean['Tocean'], dtype=float)
+    forcing = np.asarray(forcing['Forcing'], dtype=float)
+    M_at = np.asarray(CarbonClass.getFinal()[0]['M_at'], dtype=float)
+    num_periods = forcing.shape[0]
+    batch = tatm.shape[1:]
+    dt = TempClass.dt
+    para_Temp = TempClass.para_Temp
+    c1, c3, c4, Lambda, F2xco2 = (np.broadcast_to(np.asarray(v, dtype=float), batch) for v in
+                                  (para_Temp.get('c1'), para_Temp.get('c3'), para_Temp.get('c4'),
+                                   para_Temp.get('lambda'), TempClass.para_Forcing.get('F2xco2')))
+    A = step_matrix(c1, c3, c4, Lambda, dt, run_sim_order)
+    g = dt*c1
+
+    out = {}
+    # temperature impulse response KT[j] = (A^j (g, 0))[Tatm]
+    KT = np.empty((num_periods,) + batch)
+    v0, v1 = g, np.zeros(batch)
+    for j in range(num_periods):
+        KT[j] = v0
+        v0, v1 = A[..., 0, 0]*v0 + A[..., 0, 1]*v1, A[..., 1, 0]*v0 + A[..., 1, 1]*v1
+    # carbon impulse response of M_at to one step's emission
+    _, kernel = CarbonClass.propagator(num_periods)
+    KC = kernel[:, 0]*dt
+    # carbon states have no model axis; align them with the time axis
+    M_at = M_at[:num_periods].reshape((num_periods,) + M_at.shape[1:] + (1,)*(len(batch) + 1 - M_at.ndim))
+    dFdM = np.broadcast_to(F2xco2*TempClass.para_Forcing.get('Forc_fac')/(np.log(2)*M_at),
+                           (num_periods,) + batch)
+
+    t = np.arange(num_periods + 1)[:, None]
+    k = np.arange(num_periods)[None, :]
+    lag = t - 1 - k
+    # T[..., t, k] = KT[t-1-k] for k < t, C[k, s] = KC[k-1-s] for s < k
+    T = np.where(lag >= 0, np.moveaxis(KT, 0, -1)[..., np.maximum(lag, 0)], 0.)
+    lag = k.T - 1 - k
+    C = np.where(lag >= 0, KC[np.maximum(lag, 0)], 0.)
+    J = np.matmul(T*np.moveaxis(dFdM, 0, -1)[..., None, :], C)
+    out['emission'] = np.moveaxis(J, -2, 0)
+
+    # forward sensitivities S = d(Tatm, Tocean)/dparameter
+    for name in parameters:
+        if name not in PARAMETERS:
+            raise KeyError(f"no sensitivity for parameter '{name}'")
+        S = np.zeros(batch + (2,))
+        if name == 'Tatm0':
+            S[..., 0] = 1
+        elif name == 'Tocean0':
+            S[..., 1] = 1
+        sens = np.empty((num_periods + 1,) + batch)
+        sens[0] = S[..., 0]
+        zero = np.zeros(batch)
+        for i in range(num_periods):
+            x0, x1, F = tatm[i], tocean[i], forcing[i]
+            # partial derivatives of A x + g F with respect to the parameter
+            if name == 'c1':
+                d0 = -dt*(Lambda + c3)*x0 + dt*c3*x1 + dt*F
+                d1 = zero
+            elif name == 'c3':
+                d0 = -dt*c1*x0 + dt*c1*x1
+                d1 = zero
+            elif name == 'c4':
+                d0 = zero
+                d1 = -dt*x0 + dt*x1 if run_sim_order else dt*x0 - dt*x1
+            elif name == 'lambda':
+                d0 = -dt*c1*x0
+                d1 = zero
+            elif name == 'F2xco2':
+                d0 = g*F/F2xco2
+                d1 = zero
+            else:
+                d0 = d1 = zero
+            S = np.stack([A[..., 0, 0]*S[..., 0] + A[..., 0, 1]*S[..., 1] + d0,
+                          A[..., 1, 0]*S[..., 0] + A[..., 1, 1]*S[..., 1] + d1], axis=-1)
+            sens[i + 1] = S[..., 0]
+        out[name] = sens
+    return out
+
+
+def linear_update(tatm, jac, emission = None, **parameters):
+    """First-order estimate of Tatm after small changes.
+
+    emission is the change of the per-year emission path, shape (n,) or
+    broadcastable to the Jacobian's batch plus (n,); parameters give the
+    change of each parameter (scalars or batch arrays).
+    """
+    tatm = np.array(tatm, dtype=float)
+    if emission is not None:
+        tatm += np.matmul(jac['emission'], np.asarray(emission, dtype=float)[..., None])[..., 0]
+    for name, delta in parameters.items():
+        tatm += jac[name]*delta
+    return tatm
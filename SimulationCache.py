@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory caches of emulator runs.
+
+SimulationCache is an LRU keyed by a content hash of the emission path plus
+the model name, dt and forcing factor, so the same scenario shown with a
+different selection of models only costs the models that were not run yet.
+
+CheckpointStore keeps the per-step states of the last few runs so that a
+run whose emission path only differs from a recent one after some year can
+resume from that year instead of starting again in 2020.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+def emission_digest(emission):
+    """Content hash of an emission path (values and shape, as float64)."""
+    emission = np.ascontiguousarray(emission, dtype=float)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(emission.shape).encode())
+    h.update(emission.tobytes())
+    return h.hexdigest()
+
+
+class SimulationCache:
+    def __init__(self, max_entries = 4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(digest, Model_name, dt, Forcing_factor):
+        return (digest, Model_name, float(dt), float(Forcing_factor))
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        # value is a tuple of arrays; they are frozen since callers share them
+        for array in value:
+            array.setflags(write=False)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'max_entries': self.max_entries,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits/requests if requests else 0.0}
+
+
+class CheckpointStore:
+    # state histories stored per run, time on the first axis
+    STATES = ('M_at', 'M_up', 'M_lo', 'Tatm', 'Tocean')
+
+    def __init__(self, max_runs = 8):
+        self.max_runs = max_runs
+        self._runs = deque(maxlen=max_runs)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.resumes = 0
+        self.steps_skipped = 0
+
+    def add(self, emission, Model_names, dt, Forcing_factor, states):
+        """Store a run; states maps STATES to (n_periods+1, ...) arrays whose
+        temperature columns follow Model_names."""
+        emission = np.array(emission, dtype=float)
+        emission.setflags(write=False)
+        record = {'emission': emission,
+                  'models': {name: j for j, name in enumerate(Model_names)},
+                  'dt': float(dt),
+                  'Forcing_factor': float(Forcing_factor),
+                  'states': {}}
+        for name in self.STATES:
+            array = np.asarray(states[name])
+            array.setflags(write=False)
+            record['states'][name] = array
+        with self._lock:
+            self._runs.append(record)
+
+    def find(self, emission, Model_names, dt, Forcing_factor):
+        """Return (step, prefix) for the best resume point, or None.
+
+        step is the first period whose emission differs from the stored run
+        (or the shorter length if one path extends the other) and prefix
+        holds the states for periods 0..step of the requested models.
+        """
+        emission = np.asarray(emission, dtype=float)
+        with self._lock:
+            runs = list(self._runs)
+            self.lookups += 1
+        best = None
+        for record in reversed(runs):
+            if record['dt'] != float(dt) or record['Forcing_factor'] != float(Forcing_factor):
+                continue
+            if any(name not in record['models'] for name in Model_names):
+                continue
+            old = record['emission']
+            n = min(old.shape[-1], emission.shape[-1])
+            changed = np.flatnonzero(old[:n] != emission[:n])
+            step = int(changed[0]) if changed.size else n
+            if best is None or step > best[0]:
+                best = (step, record)
+        if best is None or best[0] == 0:
+            return None
+        step, record = best
+        columns = [record['models'][name] for name in Model_names]
+        prefix = {}
+        for name, array in record['states'].items():
+            if name in ('Tatm', 'Tocean'):
+                prefix[name] = array[:step + 1, columns]
+            else:
+                prefix[name] = array[:step + 1]
+        with self._lock:
+            self.resumes += 1
+            self.steps_skipped += step
+        return step, prefix
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+            self.lookups = self.resumes = self.steps_skipped = 0
+
+    def stats(self):
+        with self._lock:
+            return {'runs': len(self._runs),
+                    'max_runs': self.max_runs,
+                    'lookups': self.lookups,
+                    'resumes': self.resumes,
+                    'steps_skipped': self.steps_skipped}
@@ -6,12 +6,10 @@ Created on Mon Mar 25 17:10:41 2024
 """
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
 import numpy as np
-from numpy.linalg import matrix_power
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import pandas as pd
-from scipy.interpolate import interp1d
+
+from LinearSystem import matrix_powers, impulse_response, free_response, causal_convolve
 
 class TempModule(ABC):
     
@@ -29,37 +27,69 @@ class TempModule(ABC):
     
     
 class DICETemp(TempModule):
+    """Two-box (atmosphere/deep ocean) temperature model.
+    
+    As for CarbonCycle, horizon = n switches the histories from growing
+    lists to one preallocated float64 block of shape (3, n+1, *shape)
+    with rows Tatm, Tocean and Forcing (the latter only uses n entries);
+    getFinal then returns views into it. shape defaults to the broadcast
+    shape of the initial temperatures and the model parameters.
+    """
     
-    def __init__(self, para_Temp = {}, initial_Temp = {}, para_Forcing = {}, dt = 1):
+    def __init__(self, para_Temp = {}, initial_Temp = {}, para_Forcing = {}, dt = 1,
+                 horizon = None, shape = None):
         
         self.para_Temp = para_Temp
         self.initial_Temp = initial_Temp
         self.dt = dt
-        self.Tatm = {'Tatm': [self.initial_Temp.get('tatm0')]}
-        self.Tocean ={'Tocean':[self.initial_Temp.get('tocean0')]}
-        self.Forc = {'Forcing':[]}
         self.para_Forcing = para_Forcing
+        self.horizon = horizon
+        if horizon is not None:
+            if shape is None:
+                shape = np.broadcast_shapes(
+                    np.shape(self.initial_Temp.get('tatm0')), np.shape(self.initial_Temp.get('tocean0')),
+                    *(np.shape(self.para_Temp.get(k)) for k in ('c1', 'c3', 'c4', 'lambda')),
+                    np.shape(self.para_Forcing.get('F2xco2')))
+            self.state = np.empty((3, horizon + 1) + tuple(shape))
+        self.clear()
     
     def updateForcing(self, M_at, fex = None):
         # fex: exogeous forcing;
         # if fex is none, forcing can be adjusted via the 'Forc_fac', eg, if forc_fac = 1.3, fex = 0.3 CO2 forcing;
         if fex is None:
             forcing = self.para_Forcing.get('F2xco2')*np.log(M_at/self.para_Forcing.get('Meq_at'))/np.log(2)*self.para_Forcing.get('Forc_fac') 
-            self.Forc['Forcing'].append(forcing)
         else:
             forcing = self.para_Forcing.get('F2xco2')*np.log(M_at/self.para_Forcing.get('Meq_at'))/np.log(2)*self.para_Forcing.get('Forc_fac') + fex
+        if self.horizon is None:
             self.Forc['Forcing'].append(forcing)
+        else:
+            self.state[2, self.n_forc] = forcing
+            self.n_forc += 1
     
     def updateSurTemp(self, tatm, tocean, forcing):
         tatm = tatm+ self.dt*self.para_Temp.get('c1') *(forcing-self.para_Temp.get('lambda')*tatm-self.para_Temp.get('c3')*(tatm-tocean))
-        self.Tatm['Tatm'].append(tatm)
+        if self.horizon is None:
+            self.Tatm['Tatm'].append(tatm)
+        else:
+            self.n_tatm += 1
+            self.state[0, self.n_tatm] = tatm
         
     def updateOceanTemp(self, tocean, tatm):
         tocean = tocean + self.dt*self.para_Temp.get('c4')*(tatm-tocean)
-        self.Tocean['Tocean'].append(tocean)
+        if self.horizon is None:
+            self.Tocean['Tocean'].append(tocean)
+        else:
+            self.n_tocean += 1
+            self.state[1, self.n_tocean] = tocean
         
        
     def getFinal(self):
+        if self.horizon is not None:
+            Tatm = {'Tatm': self.state[0, :self.n_tatm + 1]}
+            Tocean = {'Tocean': self.state[1, :self.n_tocean + 1]}
+            if self.n_forc == 0:
+                return(Tatm, Tocean)
+            return(Tatm, Tocean, {'Forcing': self.state[2, :self.n_forc]})
         if self.Forc['Forcing'] == []:
             return(self.Tatm, self.Tocean)
         else:
@@ -68,6 +98,10 @@ class DICETemp(TempModule):
     
         
     def getLast(self):
+        if self.horizon is not None:
+            if self.n_forc == 0:
+                return (self.state[0, self.n_tatm], self.state[1, self.n_tocean])
+            return (self.state[0, self.n_tatm], self.state[1, self.n_tocean], self.state[2, self.n_forc - 1])
         if self.Forc['Forcing'] == []:
             return (self.Tatm['Tatm'][-1], self.Tocean['Tocean'][-1])
         else:
@@ -77,8 +111,116 @@ class DICETemp(TempModule):
     
     
     def clear(self):
+        if self.horizon is not None:
+            self.n_tatm = self.n_tocean = self.n_forc = 0
+            self.state[0, 0] = self.initial_Temp.get('tatm0')
+            self.state[1, 0] = self.initial_Temp.get('tocean0')
+            return
         self.Tatm = {'Tatm': [self.initial_Temp.get('tatm0')]}
         self.Tocean ={'Tocean':[self.initial_Temp.get('tocean0')]}
         self.Forc = {'Forcing':[]}
+    
+    def roll(self):
+        # keep only the latest temperatures, as CarbonCycle.roll
+        if self.horizon is not None:
+            self.state[0, 0] = self.state[0, self.n_tatm]
+            self.state[1, 0] = self.state[1, self.n_tocean]
+            self.n_tatm = self.n_tocean = self.n_forc = 0
+            return
+        self.Tatm = {'Tatm': self.Tatm['Tatm'][-1:]}
+        self.Tocean = {'Tocean': self.Tocean['Tocean'][-1:]}
+        self.Forc = {'Forcing': []}
+    
+    def forcingSeries(self, M_at, fex = None):
+        # same formula as updateForcing, applied to a whole M_at array with
+        # time on the last axis; a (n_models,) F2xco2 is aligned with the
+        # axis just before time, as in runHorizon
+        F2xco2 = np.asarray(self.para_Forcing.get('F2xco2'), dtype=float)
+        if F2xco2.ndim == 1:
+            F2xco2 = F2xco2[:, None]
+        forcing = F2xco2*np.log(np.asarray(M_at)/self.para_Forcing.get('Meq_at'))/np.log(2)*self.para_Forcing.get('Forc_fac')
+        if fex is not None:
+            forcing = forcing + fex
+        return forcing
+    
+    def propagator(self, num_periods, run_sim_order = True):
+        """Return (powers, kernel) of the two-box model, cached per (c1, c3, c4, lambda, dt).
         
-     
+        Only valid when the temperature parameters are scalars.
+        """
+        key = (float(self.para_Temp.get('c1')), float(self.para_Temp.get('c3')),
+               float(self.para_Temp.get('c4')), float(self.para_Temp.get('lambda')),
+               float(self.dt))
+        return temp_propagator(key, bool(run_sim_order), int(num_periods))
+    
+    def runHorizon(self, forcing, run_sim_order = True):
+        """Compute Tatm and Tocean for a whole forcing series at once.
+        
+        forcing has time on the last axis, shape (..., n), and returns two
+        arrays of shape (..., n+1) starting from the initial temperatures.
+        Temperature parameters may be (n_models,) arrays, in which case the
+        model axis of forcing is the one just before time.
+        
+        run_sim_order = True reproduces Emulator.Run_sim, which calls
+        updateOceanTemp(tatm, tocean), i.e. Tocean' = Tatm + dt*c4*(Tocean-Tatm);
+        False gives the two-box update Tocean' = Tocean + dt*c4*(Tatm-Tocean).
+        The stored histories are not modified.
+        """
+        forcing = np.asarray(forcing, dtype=float)
+        num_periods = forcing.shape[-1]
+        c1, c3, c4, Lambda = np.broadcast_arrays(
+            self.para_Temp.get('c1'), self.para_Temp.get('c3'),
+            self.para_Temp.get('c4'), self.para_Temp.get('lambda'))
+        batch_shape = forcing.shape[:-1]
+        tatm0 = np.broadcast_to(self.initial_Temp.get('tatm0'), batch_shape)
+        tocean0 = np.broadcast_to(self.initial_Temp.get('tocean0'), batch_shape)
+        T = np.empty(batch_shape + (num_periods + 1, 2))
+        if c1.ndim == 0:
+            models = [((), (...,))]
+        else:
+            models = [(j, (..., j)) for j in range(c1.shape[0])]
+        for index, state in models:
+            key = (float(c1[index]), float(c3[index]), float(c4[index]),
+                   float(Lambda[index]), float(self.dt))
+            powers, kernel = temp_propagator(key, bool(run_sim_order), num_periods)
+            x0 = np.stack([tatm0[state], tocean0[state]], axis=-1)
+            series = state + (slice(None),)
+            T[series + (slice(None),)] = free_response(powers, x0) + causal_convolve(kernel, forcing[series])
+        return(T[..., 0], T[..., 1])
+
+
+def step_matrix(c1, c3, c4, Lambda, dt = 1, run_sim_order = True):
+    """A of x_{t+1} = A x_t + g F_t with x = (Tatm, Tocean), shape (..., 2, 2).
+    
+    The parameters may be arrays, which are broadcast against each other;
+    run_sim_order as in DICETemp.runHorizon.
+    """
+    c1, c3, c4, Lambda = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (c1, c3, c4, Lambda)))
+    A = np.empty(c1.shape + (2, 2))
+    A[..., 0, 0] = 1 - dt*c1*(Lambda + c3)
+    A[..., 0, 1] = dt*c1*c3
+    if run_sim_order:
+        A[..., 1, 0] = 1 - dt*c4
+        A[..., 1, 1] = dt*c4
+    else:
+        A[..., 1, 0] = dt*c4
+        A[..., 1, 1] = 1 - dt*c4
+    return A
+
+
+def spectral_radius(c1, c3, c4, Lambda, dt = 1, run_sim_order = True):
+    """Largest |eigenvalue| of step_matrix; the time stepping is stable if < 1."""
+    return np.abs(np.linalg.eigvals(step_matrix(c1, c3, c4, Lambda, dt, run_sim_order))).max(axis=-1)
+
+
+@lru_cache(maxsize=256)
+def temp_propagator(key, run_sim_order, num_periods):
+    c1, c3, c4, Lambda, dt = key
+    # x = (Tatm, Tocean); x_{t+1} = A x_t + g F_t
+    A = step_matrix(c1, c3, c4, Lambda, dt, run_sim_order)
+    g = np.array([dt*c1, 0.])
+    powers = matrix_powers(A, num_periods)
+    kernel = impulse_response(powers, g)
+    powers.setflags(write=False)
+    kernel.setflags(write=False)
+    return powers, kernel
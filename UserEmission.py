@@ -4,49 +4,143 @@ Created on Mon Apr 29 11:05:22 2024
 
 @author: F_ZHANG
 """
-import pandas as pd
+from functools import lru_cache
 import numpy as np
-from scipy.interpolate import PchipInterpolator
-import matplotlib.pyplot as plt
+
+START_YEAR = 2020
+START_EMISSION = 10
+# arguments of Emission and emission_matrix, with the dashboard's defaults
+EMISSION_PARAMETERS = ('peak_emission', 'peak_year', 'halve_year', 'end_year', 'end_emission')
+DEFAULTS = {'peak_emission': 1.3, 'peak_year': 2050, 'halve_year': 2090,
+            'end_year': 2100, 'end_emission': 0.5}
+
 
 class Emission():
     def __init__(self, peak_emission = 1.4, peak_year = 2035, halve_year = 2065, 
                  end_year = 2100, end_emission = 0.1):
-        self.start_year = 2020
+        self.start_year = START_YEAR
         self.peak_year = peak_year
-        self.start_emission = 10
+        self.start_emission = START_EMISSION
         self.peak_emission = self.start_emission*peak_emission
         self.halve_year =  halve_year
         self.end_year = end_year
         self.end_emission = end_emission*self.start_emission
         
-    def EmissionInterpolate(self):
-        # Define the four points a, b, c, and d
-        a = (self.start_year, self.start_emission)  # (x, y)
-        b = (self.peak_year, self.peak_emission)
-        c = (self.halve_year, self.end_emission)#0.5*self.start_emission)
-        d = (self.end_year, self.end_emission)
+    def EmissionPath(self):
+        """Return (year, emission) arrays; read-only and shared between
+        Emission objects with the same parameters."""
+        return emission_path(self.start_year, self.start_emission, self.peak_year,
+                             self.peak_emission, self.halve_year, self.end_year,
+                             self.end_emission)
         
-        # Determine the maximum y value among a, c, and d
-        max_y = max(a[1], c[1], d[1], b[1])
+    def EmissionInterpolate(self):
+        # cubic Hermite interpolation (PCHIP) through the start, peak, halve
+        # and end points, see pchip_paths
+        import pandas as pd
+        year, emission_interp = self.EmissionPath()
+        emission_data = {'Year':year.copy(), 
+                         'Emission': emission_interp.copy()}
+        emission_df = pd.DataFrame(emission_data)
+        return(emission_df)
 
-        # Ensure b is the maximum among a, c, and d
-        b = (b[0], max_y)
 
-        # Arrange points for PchipInterpolator
-        x = np.array([a[0], b[0], c[0], d[0]])
-        y = np.array([a[1], b[1], c[1], d[1]])
+@lru_cache(maxsize = 1024)
+def emission_path(start_year, start_emission, peak_year, peak_emission, halve_year,
+                  end_year, end_emission):
+    """Single emission path from absolute emissions, memoized on the parameters."""
+    x = np.array([[start_year, peak_year, halve_year, end_year]], dtype=float)
+    y = np.array([[start_emission, peak_emission, end_emission, end_emission]], dtype=float)
+    year = np.arange(start_year, end_year + 1, 1)
+    emission = pchip_paths(x, y, year)[0]
+    year.setflags(write=False)
+    emission.setflags(write=False)
+    return year, emission
 
-        # Perform cubic Hermite interpolation (PchipInterpolator)
-        interp = PchipInterpolator(x, y)
 
-        # Generate points along the curve for smooth visualization
-        x_interp = np.linspace(min(x), max(x), self.end_year - self.start_year + 1)
-        emission_interp = interp(x_interp)
-        year = np.arange(self.start_year, self.end_year+1,1)
-        emission_data = {'Year':year, 
-                         'Emission': emission_interp}
-        emission_df = pd.DataFrame(emission_data)
-        return(emission_df)
+def emission_matrix(peak_emission, peak_year, halve_year, end_year = 2100, end_emission = 0.1,
+                    start_year = START_YEAR, start_emission = START_EMISSION):
+    """Emission paths of many scenarios at once.
+
+    The arguments take the same values as Emission (peak and end emission
+    as fractions of the 2020 emission) and are broadcast against each other.
+    Returns (year, emissions) with year = start_year..max(end_year) and
+    emissions of shape (n_scenarios, len(year)). Each row equals
+    Emission(...).EmissionInterpolate()['Emission'] up to its end_year and
+    stays at the end emission after it.
+
+        year, E = emission_matrix(peak_emission=np.linspace(1, 1.5, 1000),
+                                  peak_year=2040, halve_year=2080)
+    """
+    peak_emission, peak_year, halve_year, end_year, end_emission = (
+        np.ravel(v) for v in np.broadcast_arrays(
+            *(np.asarray(v, dtype=float) for v in
+              (peak_emission, peak_year, halve_year, end_year, end_emission))))
+    n = peak_emission.shape[0]
+    x = np.column_stack([np.full(n, float(start_year)), peak_year, halve_year, end_year])
+    end = end_emission*start_emission
+    y = np.column_stack([np.full(n, float(start_emission)), start_emission*peak_emission, end, end])
+    if np.any(end_year != np.round(end_year)):
+        raise ValueError('end_year must be a whole year')
+    year = np.arange(start_year, int(end_year.max()) + 1 if n else start_year, 1)
+    return year, pchip_paths(x, y, year)
+
+
+def pchip_paths(x, y, year):
+    """Evaluate one PCHIP curve per row of the (n, 4) knots x, y at year.
+
+    The y value of the second knot (the peak) is raised to the maximum of
+    the row first, as in Emission. Same arithmetic as
+    scipy.interpolate.PchipInterpolator (slopes, Hermite coefficients and
+    power-basis evaluation), so a single row gives identical values; past
+    the last knot the curve is held at its last value instead of
+    extrapolated.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.array(y, dtype=float)
+    y[:, 1] = y.max(axis=1)
+    hk = np.diff(x, axis=1)
+    if np.any(hk <= 0):
+        bad = np.flatnonzero(np.any(hk <= 0, axis=1))
+        raise ValueError('start_year < peak_year < halve_year < end_year must hold; '
+                         f'it does not for scenarios {bad.tolist()[:10]}')
+    mk = np.diff(y, axis=1)/hk
+
+    # slopes at the knots: weighted harmonic mean inside, zero at extrema,
+    # one-sided three-point estimate at the ends
+    smk = np.sign(mk)
+    condition = (smk[:, 1:] != smk[:, :-1]) | (mk[:, 1:] == 0) | (mk[:, :-1] == 0)
+    w1 = 2*hk[:, 1:] + hk[:, :-1]
+    w2 = hk[:, 1:] + 2*hk[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        whmean = (w1/mk[:, :-1] + w2/mk[:, 1:])/(w1 + w2)
+        inner = np.where(condition, 0.0, 1.0/whmean)
+    dk = np.empty_like(y)
+    dk[:, 1:-1] = inner
+    dk[:, 0] = _edge_slope(hk[:, 0], hk[:, 1], mk[:, 0], mk[:, 1])
+    dk[:, -1] = _edge_slope(hk[:, -1], hk[:, -2], mk[:, -1], mk[:, -2])
+
+    # Hermite coefficients of each interval in powers of (t - x_k)
+    t = (dk[:, :-1] + dk[:, 1:] - 2*mk)/hk
+    c0 = t/hk
+    c1 = (mk - dk[:, :-1])/hk - t
+    c2 = dk[:, :-1]
+    c3 = y[:, :-1]
+
+    t = np.asarray(year, dtype=float)[None, :]
+    t = np.minimum(t, x[:, -1:])
+    k = (t >= x[:, 1:2]).astype(np.intp) + (t >= x[:, 2:3])
+    s = t - np.take_along_axis(x, k, axis=1)
+    res = np.take_along_axis(c3, k, axis=1) + np.take_along_axis(c2, k, axis=1)*s
+    z = s*s
+    res = res + np.take_along_axis(c1, k, axis=1)*z
+    z = z*s
+    res = res + np.take_along_axis(c0, k, axis=1)*z
+    return res
+
 
-        
\ No newline at end of file
+def _edge_slope(h0, h1, m0, m1):
+    d = ((2*h0 + h1)*m0 - h0*m1)/(h0 + h1)
+    # keep the shape: no overshoot and the sign of the first segment
+    mask = np.sign(d) != np.sign(m0)
+    mask2 = (np.sign(m0) != np.sign(m1)) & (np.abs(d) > 3.*np.abs(m0))
+    return np.where(mask, 0., np.where(mask2, 3.*m0, d))
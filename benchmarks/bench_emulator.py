@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the emulator hot paths.
+
+Times Emulator.Run_sim and its per-run setup, Emulator.Temp_CMIP,
+ensemble runs over 1/17/21/all models, scenario sweeps from 1 to 10k
+scenarios, the inverse solver, Run_timestep from monthly to adaptive
+steps, Emission.EmissionInterpolate, batch emission paths and the
+spreadsheet loads, for 80 and 500 year horizons with dt of 1 and 0.25.
+Each case reports the median/min wall time and the peak traced memory of
+one run.
+
+    python benchmarks/bench_emulator.py --json results.json
+    python benchmarks/bench_emulator.py --baseline benchmarks/baseline.json --threshold 0.25
+
+With --baseline the results are compared case by case and the script exits
+with status 1 if any median time (or peak memory) is more than threshold
+above the baseline. --save-baseline writes the current results as the new
+baseline. --quick skips the largest cases.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+import EmulatorCore
+import ParameterStore
+from EmulatorCore import Emulator, Run_sweep, Temp_ensemble
+from InverseSolver import solve_emission
+from TimeStepping import Run_timestep
+from UserEmission import Emission, emission_matrix
+
+MODEL_COUNTS = (1, 17, 21, None)
+HORIZONS = (80, 500)
+TIME_STEPS = (1, 0.25)
+SCENARIOS = (1, 100, 1000, 10000)
+
+
+def emission_path(years, dt):
+    # dashboard-like path, held at the end value after 2100 and repeated
+    # for sub-annual steps (emission is per step, as in Run_sim)
+    path = Emission(peak_emission=1.3, peak_year=2050, halve_year=2090,
+                    end_emission=0.5).EmissionInterpolate()['Emission'].to_numpy()
+    path = np.concatenate([path, np.full(max(years + 1 - len(path), 0), path[-1])])[:years + 1]
+    return np.repeat(path, int(round(1/dt)))
+
+
+def model_names(count):
+    names = EmulatorCore.CMIP.index.tolist()
+    if count == 17:
+        return EmulatorCore.CMIP5.index.tolist()
+    if count == 21:
+        return EmulatorCore.CMIP6.index.tolist()
+    return names if count is None else names[:count]
+
+
+def cases(quick):
+    """Yield (name, function) pairs; each function runs the case once."""
+    for years in HORIZONS:
+        for dt in TIME_STEPS:
+            if quick and years == 500 and dt == 0.25:
+                continue
+            emission = emission_path(years, dt)
+            yield (f'Run_sim/models=1/years={years}/dt={dt}',
+                   lambda e=emission, dt=dt: Emulator(e, 'MMM_CMIP6', dt).Run_sim())
+            for count in MODEL_COUNTS:
+                names = model_names(count)
+                label = 'all' if count is None else count
+                yield (f'ensemble/models={label}/years={years}/dt={dt}',
+                       lambda e=emission, n=names, dt=dt: Temp_ensemble(e, n, dt, cache=None))
+
+    emission = emission_path(80, 1)[:81]
+
+    # per-run setup of one Emulator, and the CMIP6_prediction pattern of
+    # switching models on a single Emulator
+    emulator = Emulator(emission, 'MMM_CMIP6')
+    yield 'Emulator.clear/years=80', emulator.clear
+
+    def predictions():
+        for name in EmulatorCore.CMIP6.index.tolist():
+            emulator.Model = EmulatorCore.CMIP.loc[name]
+            emulator.Run_sim()
+    yield 'Run_sim/models=21/one Emulator/years=80', predictions
+
+    def temp_cmip():
+        EmulatorCore.simulation_cache.clear()
+        EmulatorCore.simulation_checkpoints.clear()
+        return Emulator.Temp_CMIP(emission)
+    yield 'Temp_CMIP/uncached', temp_cmip
+    yield 'Temp_CMIP/cached', lambda: Emulator.Temp_CMIP(emission)
+
+    for n in SCENARIOS:
+        if quick and n > 1000:
+            continue
+        matrix = np.tile(emission, (n, 1)) * np.linspace(0.5, 1.5, n)[:, None]
+        yield (f'sweep/scenarios={n}/models=all/years=80/dt=1',
+               lambda m=matrix: Run_sweep(m, variables=('Tatm',)))
+
+    yield ('solve_emission/peak_emission/models=all',
+           lambda: solve_emission(2.5, 'peak_emission', bounds=(0.5, 3.0), peak_year=2035,
+                                  halve_year=2060, end_emission=0.1))
+
+    for dt in ('monthly', 'quarterly', 1, 'adaptive'):
+        yield (f'Run_timestep/dt={dt}/models=all/years=80',
+               lambda dt=dt: Run_timestep(emission, dt=dt))
+
+    yield ('EmissionInterpolate/years=80',
+           lambda: Emission(peak_emission=1.3, peak_year=2050, halve_year=2090,
+                            end_emission=0.5).EmissionInterpolate())
+    for n in SCENARIOS:
+        if quick and n > 1000:
+            continue
+        yield (f'emission_matrix/scenarios={n}/years=80',
+               lambda n=n: emission_matrix(np.linspace(0.5, 1.5, n), 2050, 2090, 2100, 0.5))
+
+    def compile_parameters():
+        with tempfile.TemporaryDirectory() as tmp:
+            return ParameterStore.ParameterStore(cache=Path(tmp)/'cache.npz').load()
+    yield 'xlsx/CMIPparas/compile', compile_parameters
+    yield 'xlsx/CMIPparas/cached', lambda: ParameterStore.ParameterStore().load()
+
+    def read_emissions():
+        import pandas as pd
+        return pd.read_excel(ROOT/'data/RCPemissions.xlsx', sheet_name='Emission')
+    yield 'xlsx/RCPemissions', read_emissions
+
+
+def measure(fn, repeat):
+    fn()  # warm-up: imports, parameter cache, kernels
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'median_s': statistics.median(times), 'min_s': min(times),
+            'repeat': repeat, 'peak_bytes': peak}
+
+
+def compare(results, baseline, threshold):
+    """Return the list of regressions against a baseline result file."""
+    previous = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        for key in ('median_s', 'peak_bytes'):
+            if old[key] > 0 and case[key] > old[key]*(1 + threshold):
+                regressions.append(f"{case['name']}: {key} {old[key]:.4g} -> {case[key]:.4g} "
+                                   f"(+{100*(case[key]/old[key] - 1):.0f}%)")
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='skip the largest cases')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against this result file')
+    parser.add_argument('--save-baseline', help='write the results to this baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed relative slowdown before failing (default 0.25)')
+    args = parser.parse_args(argv)
+
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'cases': []}
+    for name, fn in cases(args.quick):
+        if args.filter not in name:
+            continue
+        r = measure(fn, args.repeat)
+        r['name'] = name
+        results['cases'].append(r)
+        print(f"{name:<48} median {r['median_s']*1000:10.2f} ms   "
+              f"min {r['min_s']*1000:10.2f} ms   peak {r['peak_bytes']/2**20:8.1f} MiB", flush=True)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('\nRegressions:')
+            for line in regressions:
+                print('  ' + line)
+            return 1
+        print('\nNo regressions above {:.0f}%'.format(100*args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark for the emulator core.
+
+Each measurement runs in a fresh interpreter so nothing is already cached
+in sys.modules. Also checks that the numerical modules do not pull in the
+plotting or dataframe stack, and exits with status 1 if they do.
+
+    python benchmarks/bench_import.py [--repeat 5] [--json results.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = ('CarbonModule', 'TempModule', 'EmulatorCore', 'UserEmission')
+# modules that must stay out of a plain `import EmulatorCore`
+HEAVY = ('pandas', 'plotly', 'matplotlib', 'scipy', 'openpyxl')
+NUMERICAL = ('CarbonModule', 'TempModule', 'EmulatorCore', 'UserEmission')
+
+PROBE = '''
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{'seconds': t1 - t0, 'heavy': heavy}}))
+'''
+
+
+def measure(module, repeat):
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)],
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    return {'module': module,
+            'median_s': statistics.median(times),
+            'min_s': min(times),
+            'heavy_modules': heavy}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = [measure(module, args.repeat) for module in MODULES]
+    failed = False
+    for r in results:
+        flag = ''
+        if r['module'] in NUMERICAL and r['heavy_modules']:
+            flag = '  <-- loads ' + ', '.join(r['heavy_modules'])
+            failed = True
+        print(f"{r['module']:<14} median {r['median_s']*1000:8.1f} ms   min {r['min_s']*1000:8.1f} ms{flag}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
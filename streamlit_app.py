@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
 import math
+import threading
 from pathlib import Path
 #### Import Emulator
-from EmulatorCore import Emulator
+from EmulatorCore import Emulator, simulation_cache
 from UserEmission import Emission
+from ScenarioTable import ScenarioTable
 
 # Set the title and favicon that appear in the Browser's tab bar.
 st.set_page_config(
@@ -70,6 +72,8 @@ def get_gdp_data():
 
 gdp_df = get_gdp_data()
 
+@st.cache_data
+
 def get_data():
     ### Read in emissions data
     DATA_FILENAME_EMISSIONS = Path(__file__).parent/'data/RCPemissions.xlsx'
@@ -93,6 +97,49 @@ def get_data():
 
 Emissions = get_data()
 
+# Scenarios kept by get_temperatures; st.cache_data is shared by all
+# sessions, so a popular scenario is only computed once
+TEMPERATURE_CACHE_ENTRIES = 256
+
+@st.cache_resource
+
+def get_cache_counters():
+    """Request counters shared by all sessions (st.cache_data keeps none)."""
+    return {'lock': threading.Lock(), 'requests': 0, 'computed': 0, 'looked_up': 0}
+
+def count(name):
+    counters = get_cache_counters()
+    with counters['lock']:
+        counters[name] += 1
+
+# built offline by `python ScenarioTable.py data/ScenarioTable`
+SCENARIO_TABLE = Path(__file__).parent/'data/ScenarioTable'
+
+@st.cache_resource
+
+def get_scenario_table():
+    """The precomputed scenario table, or None if it was not built (or is outdated)."""
+    if not (SCENARIO_TABLE/'manifest.json').exists():
+        return None
+    try:
+        return ScenarioTable.open(SCENARIO_TABLE)
+    except ValueError:
+        return None
+
+@st.cache_data(max_entries=TEMPERATURE_CACHE_ENTRIES, show_spinner=False)
+
+def get_temperatures(peak_emission, peak_year, halve_year, end_emission):
+    """Emission path and CMIP temperatures for one set of Emission parameters."""
+    count('computed')
+    emission = Emission(peak_emission=peak_emission, peak_year=peak_year, halve_year=halve_year, end_emission= end_emission).EmissionInterpolate()
+    table = get_scenario_table()
+    if table is not None and table.contains(peak_emission, peak_year, halve_year, end_emission):
+        count('looked_up')
+        tatm_df = table.result_table(peak_emission, peak_year, halve_year, end_emission).to_frame()
+    else:
+        tatm_df = Emulator.Temp_CMIP(emission=emission['Emission'])
+    return emission, tatm_df
+
 # ### choose one emission path
 # emission = Emissions['SSP5-34-OS']
 
@@ -170,8 +217,9 @@ with col1:
     peak_emission = peak_emission/100
     end_emission = end_emission/100
     
-    test_Emission = Emission(peak_emission=peak_emission, peak_year=peak_year, halve_year=halve_year, end_emission= end_emission)
-    emission = test_Emission.EmissionInterpolate()  
+    # cached across sessions, keyed by the parameters
+    count('requests')
+    emission, tatm_df = get_temperatures(peak_emission, peak_year, halve_year, end_emission)
     
     # Plot the Emission Path
     container_graph_emissions.line_chart(
@@ -230,8 +278,7 @@ with col2:
     "NorESM1-M",
     ]
 
-    # Compute the Temperature paths for all possible models (CMIP6, maybe CMIP5 also) into a dataframe
-    tatm_df = Emulator.Temp_CMIP(emission=emission['Emission'])
+    # The Temperature paths for all possible models (CMIP6 and CMIP5) come from get_temperatures above
 
     container_graph_temperatures = st.container()
 
@@ -279,6 +326,28 @@ with col2:
         #color='Model',
     )
 
+    with st.expander("Cache statistics"):
+        counters = get_cache_counters()
+        with counters['lock']:
+            requests, computed = counters['requests'], counters['computed']
+            looked_up = counters['looked_up']
+        model_stats = simulation_cache.stats()
+        col31, col32, col33, col34 = st.columns(4)
+        col31.metric("Scenario requests", f"{requests:,}")
+        col32.metric("Scenarios computed", f"{computed:,}",
+                     help=f"At most {TEMPERATURE_CACHE_ENTRIES} scenarios are kept, shared by all sessions")
+        col33.metric("Scenario hit rate", f"{1 - computed/requests:.0%}" if requests else "n/a")
+        col34.metric("Model runs cached", f"{model_stats['entries']:,} / {model_stats['max_entries']:,}",
+                     help=f"Per-model hit rate {model_stats['hit_rate']:.0%}, {model_stats['evictions']:,} evictions")
+        table = get_scenario_table()
+        if table is None:
+            st.caption("No precomputed scenario table; every scenario is simulated.")
+        else:
+            error = "" if table.error_bound is None else (
+                f" (interpolation error below {table.error_bound:.2f} °C: at most {table.max_abs_error:.3f} °C "
+                f"on {table.manifest['n_checked']:,} checked scenarios, plus a 50% margin)")
+            st.caption(f"{looked_up:,} of the computed scenarios were read from the precomputed table{error}.")
+
 # # Add some spacing
 # ''
 # ''
@@ -0,0 +1,25 @@
+import numpy as np
+
+from EmulatorCore import Run_sweep
+from RunArchive import RunArchive
+from UserEmission import emission_matrix
+
+
+def test_run_sweep_write_read_round_trip(tmp_path):
+    _, emissions = emission_matrix(np.linspace(0.8, 1.6, 6), 2050, 2090)
+    Model_names = ['MIROC6', 'CanESM2', 'MMM_CMIP6']
+    variables = ('Tatm', 'Tocean', 'M_at', 'Forcing')
+    results = Run_sweep(emissions, Model_names, variables=variables)
+
+    archive = RunArchive.create(tmp_path/'sweep', emissions, Model_names, variables)
+    archive.write(0, {name: values[:4] for name, values in results.items()})
+    archive.write(4, {name: values[4:] for name, values in results.items()})
+    archive.close()
+
+    archive = RunArchive.open(tmp_path/'sweep')
+    assert np.asarray(archive.done).all()
+    for name in variables:
+        expected = results[name][:, :1] if name.startswith('M_') else results[name]
+        np.testing.assert_array_equal(archive.read(name), expected)
+    np.testing.assert_array_equal(archive.read('Tatm', scenarios=2, models=['CanESM2']),
+                                  results['Tatm'][2:3, 1:2])
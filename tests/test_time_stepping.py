@@ -0,0 +1,16 @@
+import numpy as np
+
+from EmulatorCore import CMIP, Emulator
+from TimeStepping import Run_timestep
+from UserEmission import Emission
+
+
+def test_annual_step_reproduces_run_sim():
+    emission = Emission(1.3, 2050, 2090, 2100, 0.5).EmissionInterpolate()['Emission'].to_numpy()
+    Model_names = CMIP.index.tolist()
+    tatm, tocean = Run_timestep(emission, Model_names, dt=1)
+    for j, name in enumerate(Model_names):
+        expected_tatm, expected_tocean = Emulator(emission, name).Run_sim()
+        np.testing.assert_array_equal(tatm[:, j], expected_tatm)
+        np.testing.assert_array_equal(tocean[:, j], expected_tocean)
+    np.testing.assert_array_equal(tatm, Emulator.Temp_CMIP(emission)[Model_names].to_numpy())